@@ -0,0 +1,662 @@
+"""
+Импорт истории переписки из другого мессенджера.
+
+Файлы NDJSON или CSV (формат определяется по расширению). Сущности
+ссылаются друг на друга идентификаторами исходной системы:
+
+    --users          id, phone, login, first_name, last_name, email,
+                     created_at
+    --conversations  id, type_id, title, created_at
+    --members        conversation_id, user_id, created_at
+    --messages       id, conversation_id, author_id, parent_id, text,
+                     created_at
+    --attachments    message_id, document_id, filename, size_bytes,
+                     mime_type
+
+Строки загружаются через COPY во временные таблицы, там же проверяются
+внешние ключи, после чего всё переносится в рабочие таблицы одной
+транзакцией. Ключи uuid7 строятся по created_at, поэтому порядок uuid
+совпадает с хронологией. Пользователь с уже существующим телефоном не
+создаётся заново: импортированные записи ссылаются на него.
+
+Запуск: python -m app.db.commands.import_history --users users.ndjson \
+    --conversations conversations.csv --members members.csv \
+    --messages messages.ndjson --attachments attachments.ndjson
+"""
+import argparse
+import asyncio
+import csv
+import datetime
+import json
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Iterator
+from typing import NamedTuple
+from typing import Optional
+from uuid import UUID
+
+from asyncpg import Connection
+from uuid_extensions import uuid7
+
+from app.db.types.date_time import MOSCOW_TIMEZONE
+from misc import engine
+
+
+class HistoryImportError(Exception):
+    pass
+
+
+def _text(row: dict[str, Any], key: str) -> Optional[str]:
+    value = row.get(key)
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+def _integer(row: dict[str, Any], key: str) -> Optional[int]:
+    value = _text(row, key)
+    return None if value is None else int(value)
+
+
+def _timestamp(row: dict[str, Any], key: str) -> datetime.datetime:
+    """
+    ISO 8601 или unix-время. Без часового пояса считается UTC, пустое
+    значение - текущее время
+    """
+    value = row.get(key)
+    if value is None or value == "":
+        return datetime.datetime.now(datetime.timezone.utc)
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
+
+    parsed = datetime.datetime.fromisoformat(
+        str(value).replace("Z", "+00:00")
+    )
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def _moscow(value: datetime.datetime) -> datetime.datetime:
+    # Как TZDateTime: время хранится по Москве без часового пояса
+    return value.astimezone(MOSCOW_TIMEZONE).replace(tzinfo=None)
+
+
+def _uuid7_at(value: datetime.datetime) -> UUID:
+    return uuid7(ns=round(value.timestamp() * 1_000_000) * 1000)
+
+
+def _parse_user(row: dict[str, Any]) -> tuple:
+    created_at = _timestamp(row, "created_at")
+    return (
+        _text(row, "id"),
+        _uuid7_at(created_at),
+        _text(row, "phone"),
+        _text(row, "email"),
+        _text(row, "login"),
+        _text(row, "first_name"),
+        _text(row, "last_name"),
+        _moscow(created_at),
+    )
+
+
+def _parse_conversation(row: dict[str, Any]) -> tuple:
+    created_at = _timestamp(row, "created_at")
+    title = _text(row, "title")
+    return (
+        _text(row, "id"),
+        _uuid7_at(created_at),
+        _uuid7_at(created_at) if title is not None else None,
+        _integer(row, "type_id") or 1,
+        title,
+        _moscow(created_at),
+    )
+
+
+def _parse_member(row: dict[str, Any]) -> tuple:
+    return (
+        _text(row, "conversation_id"),
+        _text(row, "user_id"),
+        _moscow(_timestamp(row, "created_at")),
+    )
+
+
+def _parse_message(row: dict[str, Any]) -> tuple:
+    created_at = _timestamp(row, "created_at")
+    return (
+        _text(row, "id"),
+        _uuid7_at(created_at),
+        _text(row, "conversation_id"),
+        _text(row, "author_id"),
+        _text(row, "parent_id"),
+        _text(row, "text"),
+        _moscow(created_at),
+    )
+
+
+def _parse_attachment(row: dict[str, Any]) -> tuple:
+    document_id = _text(row, "document_id")
+    size_bytes = _text(row, "size_bytes")
+    return (
+        _text(row, "message_id"),
+        uuid7(),
+        uuid7(),
+        UUID(document_id) if document_id is not None else None,
+        _text(row, "filename"),
+        Decimal(size_bytes) if size_bytes is not None else None,
+        _text(row, "mime_type"),
+    )
+
+
+class StagingTable(NamedTuple):
+    source: str
+    name: str
+    columns: tuple[tuple[str, str], ...]
+    parse: Callable[[dict[str, Any]], tuple]
+    indexes: tuple[str, ...] = ()
+
+
+# Колонки staging-таблиц в порядке кортежей _parse_*. id, conversation_id,
+# user_id, author_id, parent_id, message_id - идентификаторы исходной
+# системы, сгенерированные ключи лежат в uuid
+STAGING_TABLES = (
+    StagingTable(
+        source="users",
+        name="import_users",
+        columns=(
+            ("id", "text"),
+            ("uuid", "uuid"),
+            ("phone", "text"),
+            ("email", "text"),
+            ("login", "text"),
+            ("first_name", "text"),
+            ("last_name", "text"),
+            ("created_at", "timestamp"),
+        ),
+        parse=_parse_user,
+        indexes=("id", "phone", "login"),
+    ),
+    StagingTable(
+        source="conversations",
+        name="import_conversations",
+        columns=(
+            ("id", "text"),
+            ("uuid", "uuid"),
+            ("chat_uuid", "uuid"),
+            ("type_id", "integer"),
+            ("title", "text"),
+            ("created_at", "timestamp"),
+        ),
+        parse=_parse_conversation,
+        indexes=("id",),
+    ),
+    StagingTable(
+        source="members",
+        name="import_members",
+        columns=(
+            ("conversation_id", "text"),
+            ("user_id", "text"),
+            ("created_at", "timestamp"),
+        ),
+        parse=_parse_member,
+    ),
+    StagingTable(
+        source="messages",
+        name="import_messages",
+        columns=(
+            ("id", "text"),
+            ("uuid", "uuid"),
+            ("conversation_id", "text"),
+            ("author_id", "text"),
+            ("parent_id", "text"),
+            ("text", "text"),
+            ("created_at", "timestamp"),
+        ),
+        parse=_parse_message,
+        indexes=("id", "conversation_id", "parent_id"),
+    ),
+    StagingTable(
+        source="attachments",
+        name="import_attachments",
+        columns=(
+            ("message_id", "text"),
+            ("uuid", "uuid"),
+            ("document_uuid", "uuid"),
+            ("document_id", "uuid"),
+            ("filename", "text"),
+            ("size_bytes", "numeric"),
+            ("mime_type", "text"),
+        ),
+        parse=_parse_attachment,
+    ),
+)
+
+
+def _duplicate(table: str, *columns: str) -> str:
+    matches = " or ".join(f"d.{column} = s.{column}" for column in columns)
+    return (
+        f"exists (select 1 from {table} d "
+        f"where d.ctid <> s.ctid and ({matches}))"
+    )
+
+
+def _missing(table: str, column: str) -> str:
+    return f"not exists (select 1 from {table} r where r.id = s.{column})"
+
+
+# (staging-таблица, описание, условие некорректной строки s)
+CHECKS = (
+    (
+        "import_users",
+        "не заполнены id, телефон, логин или имя",
+        "s.id is null or s.phone is null or s.login is null "
+        "or s.first_name is null or s.last_name is null",
+    ),
+    (
+        "import_users",
+        "телефон или имя длиннее колонки",
+        "char_length(s.phone) > 20 or char_length(s.first_name) > 255 "
+        "or char_length(s.last_name) > 255",
+    ),
+    (
+        "import_users",
+        "повторяются id, телефон или логин",
+        _duplicate("import_users", "id", "phone", "login"),
+    ),
+    (
+        "import_users",
+        "логин или email заняты другим пользователем",
+        "exists (select 1 from users u where u.phone <> s.phone "
+        "and (u.login = s.login or u.email = s.email))",
+    ),
+    (
+        "import_conversations",
+        "не заполнен или повторяется id",
+        f"s.id is null or {_duplicate('import_conversations', 'id')}",
+    ),
+    (
+        "import_conversations",
+        "неизвестный type_id",
+        "not exists (select 1 from chats_types t where t.id = s.type_id)",
+    ),
+    (
+        "import_members",
+        "нет чата",
+        _missing("import_conversations", "conversation_id"),
+    ),
+    (
+        "import_members",
+        "нет пользователя",
+        _missing("import_users", "user_id"),
+    ),
+    (
+        "import_messages",
+        "не заполнен или повторяется id",
+        f"s.id is null or {_duplicate('import_messages', 'id')}",
+    ),
+    (
+        "import_messages",
+        "нет чата",
+        _missing("import_conversations", "conversation_id"),
+    ),
+    (
+        "import_messages",
+        "нет автора",
+        _missing("import_users", "author_id"),
+    ),
+    (
+        "import_messages",
+        "нет родительского сообщения в этом чате",
+        "s.parent_id is not null and not exists (select 1 "
+        "from import_messages r where r.id = s.parent_id "
+        "and r.conversation_id = s.conversation_id)",
+    ),
+    (
+        "import_messages",
+        "текст длиннее 2048 символов",
+        "char_length(s.text) > 2048",
+    ),
+    (
+        "import_attachments",
+        "нет сообщения",
+        _missing("import_messages", "message_id"),
+    ),
+    (
+        "import_attachments",
+        "не заполнен document_id",
+        "s.document_id is null",
+    ),
+)
+
+REUSE_EXISTING_USERS = """
+update import_users s
+set uuid = u.uuid, existing = true
+from users u
+where u.phone = s.phone
+"""
+
+# (рабочая таблица, запрос переноса из staging)
+TRANSFERS = (
+    (
+        "users",
+        """
+        insert into users (
+            uuid, phone, email, login, first_name, last_name,
+            status_id, is_online, last_activity, created_at, updated_at
+        )
+        select
+            s.uuid, s.phone, s.email, s.login, s.first_name, s.last_name,
+            1, false, now(), s.created_at, s.created_at
+        from import_users s
+        where not s.existing
+        """,
+    ),
+    (
+        "chats",
+        """
+        insert into chats (uuid, title, status_id, created_at, updated_at)
+        select s.chat_uuid, s.title, 1, s.created_at, s.created_at
+        from import_conversations s
+        where s.chat_uuid is not null
+        """,
+    ),
+    (
+        "conversations",
+        """
+        insert into conversations (
+            uuid, type_id, chat_id, created_at, updated_at, last_message_at
+        )
+        select
+            s.uuid,
+            s.type_id,
+            s.chat_uuid,
+            s.created_at,
+            s.created_at,
+            coalesce(
+                (
+                    select max(m.created_at)
+                    from import_messages m
+                    where m.conversation_id = s.id and m.parent_id is null
+                ),
+                s.created_at
+            ) at time zone 'Europe/Moscow'
+        from import_conversations s
+        """,
+    ),
+    (
+        "users_conversations",
+        """
+        insert into users_conversations (
+            conversation_id, user_id, created_at, updated_at
+        )
+        select c.uuid, u.uuid, min(s.created_at), min(s.created_at)
+        from import_members s
+        join import_conversations c on c.id = s.conversation_id
+        join import_users u on u.id = s.user_id
+        group by c.uuid, u.uuid
+        """,
+    ),
+    (
+        "messages",
+        """
+        insert into messages (
+            uuid, conversation_id, author_id, parent_id, text,
+            reply_count, created_at, updated_at
+        )
+        select
+            s.uuid,
+            c.uuid,
+            u.uuid,
+            p.uuid,
+            s.text,
+            (
+                select count(*)
+                from import_messages r
+                where r.parent_id = s.id
+            ),
+            s.created_at,
+            s.created_at
+        from import_messages s
+        join import_conversations c on c.id = s.conversation_id
+        join import_users u on u.id = s.author_id
+        left join import_messages p on p.id = s.parent_id
+        """,
+    ),
+    (
+        "documents",
+        """
+        insert into documents (
+            uuid, document_id, filename, size_bytes, mime_type,
+            created_at, updated_at
+        )
+        select
+            s.document_uuid, s.document_id, s.filename, s.size_bytes,
+            s.mime_type, m.created_at, m.created_at
+        from import_attachments s
+        join import_messages m on m.id = s.message_id
+        """,
+    ),
+    (
+        "messages_documents",
+        """
+        insert into messages_documents (uuid, message_id, document_id)
+        select s.uuid, m.uuid, s.document_uuid
+        from import_attachments s
+        join import_messages m on m.id = s.message_id
+        """,
+    ),
+    (
+        "users_inbox",
+        """
+        insert into users_inbox (
+            user_id,
+            conversation_id,
+            last_message_id,
+            last_message_preview,
+            last_message_at,
+            last_read_message_id
+        )
+        select
+            uc.user_id,
+            uc.conversation_id,
+            last_message.uuid,
+            left(last_message.text, 255),
+            c.last_message_at,
+            last_message.uuid
+        from import_conversations s
+        join conversations c on c.uuid = s.uuid
+        join users_conversations uc on uc.conversation_id = s.uuid
+        left join lateral (
+            select m.uuid, m.text
+            from messages m
+            where m.conversation_id = s.uuid
+              and m.parent_id is null
+            order by m.uuid desc
+            limit 1
+        ) as last_message on true
+        """,
+    ),
+)
+
+
+def _read_rows(path: Path) -> Iterator[dict[str, Any]]:
+    with path.open(encoding="utf-8", newline="") as file:
+        if path.suffix.lower() == ".csv":
+            yield from csv.DictReader(file)
+            return
+
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _read_records(table: StagingTable, path: Path) -> Iterator[tuple]:
+    number = 1
+    try:
+        for row in _read_rows(path):
+            if not isinstance(row, dict):
+                raise ValueError("ожидается объект")
+            yield table.parse(row)
+            number += 1
+    except (ValueError, TypeError) as e:
+        raise HistoryImportError(f"{path}, запись {number}: {e}") from e
+
+
+def _affected(status: str) -> int:
+    # Статус команды: "COPY 10", "INSERT 0 10", "DELETE 10"
+    return int(status.rsplit(" ", 1)[-1])
+
+
+def _report(title: str, rows: int, seconds: float) -> None:
+    rate = rows / seconds if seconds else 0
+    print(f"  {title}: {rows} строк за {seconds:.2f} с ({rate:.0f} строк/с)")
+
+
+async def _create_staging(connection: Connection) -> None:
+    for table in STAGING_TABLES:
+        columns = ", ".join(
+            f"{name} {type_}" for name, type_ in table.columns
+        )
+        await connection.execute(
+            f"create temp table {table.name} ({columns}) on commit drop"
+        )
+    await connection.execute(
+        "alter table import_users "
+        "add column existing boolean not null default false"
+    )
+
+
+async def _load_staging(
+    connection: Connection, files: dict[str, Optional[Path]]
+) -> None:
+    print("Загрузка во временные таблицы:")
+    for table in STAGING_TABLES:
+        path = files[table.source]
+        if path is not None:
+            started = time.perf_counter()
+            status = await connection.copy_records_to_table(
+                table.name,
+                records=_read_records(table=table, path=path),
+                columns=[name for name, _ in table.columns],
+            )
+            _report(
+                table.source, _affected(status), time.perf_counter() - started
+            )
+
+        for column in table.indexes:
+            await connection.execute(
+                f"create index on {table.name} ({column})"
+            )
+        await connection.execute(f"analyze {table.name}")
+
+
+async def _validate(connection: Connection, skip_invalid: bool) -> None:
+    """
+    Без skip_invalid любая некорректная строка отменяет импорт. С ним
+    строки удаляются из staging, пока не останется ссылок на удалённые
+    (ответы на отброшенное сообщение, вложения и т.п.)
+    """
+    invalid: dict[tuple[str, str], int] = {}
+    while True:
+        found = 0
+        for table, description, condition in CHECKS:
+            if skip_invalid:
+                status = await connection.execute(
+                    f"delete from {table} s where {condition}"
+                )
+                count = _affected(status)
+            else:
+                count = await connection.fetchval(
+                    f"select count(*) from {table} s where {condition}"
+                )
+            if count:
+                key = (table, description)
+                invalid[key] = invalid.get(key, 0) + count
+                found += count
+        if not skip_invalid or not found:
+            break
+
+    if not invalid:
+        return
+
+    print("Отброшено при проверке:" if skip_invalid else "Ошибки данных:")
+    for (table, description), count in invalid.items():
+        print(f"  {table}: {description} - {count}")
+    if not skip_invalid:
+        raise HistoryImportError(
+            "Импорт отменён, для пропуска строк используйте --skip-invalid"
+        )
+
+
+async def _transfer(connection: Connection) -> int:
+    await connection.execute(REUSE_EXISTING_USERS)
+
+    print("Перенос в рабочие таблицы:")
+    total = 0
+    for table, query in TRANSFERS:
+        started = time.perf_counter()
+        rows = _affected(await connection.execute(query))
+        _report(table, rows, time.perf_counter() - started)
+        total += rows
+    return total
+
+
+async def import_history(args: argparse.Namespace) -> None:
+    files = {
+        table.source: getattr(args, table.source) for table in STAGING_TABLES
+    }
+    started = time.perf_counter()
+    try:
+        async with engine.connect() as connection:
+            raw_connection = await connection.get_raw_connection()
+            driver: Connection = raw_connection.driver_connection
+            transaction = driver.transaction()
+            await transaction.start()
+            try:
+                await _create_staging(driver)
+                await _load_staging(driver, files=files)
+                await _validate(driver, skip_invalid=args.skip_invalid)
+                total = await _transfer(driver)
+            except BaseException:
+                await transaction.rollback()
+                raise
+
+            if args.dry_run:
+                await transaction.rollback()
+                print("Пробный запуск, изменения отменены")
+            else:
+                await transaction.commit()
+    except HistoryImportError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        await engine.dispose()
+
+    _report("Итого", total, time.perf_counter() - started)
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Импорт истории переписки из NDJSON/CSV"
+    )
+    for table in STAGING_TABLES:
+        parser.add_argument(f"--{table.source}", type=Path)
+    parser.add_argument(
+        "--skip-invalid",
+        action="store_true",
+        help="Пропускать строки, не прошедшие проверку",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Проверить и перенести данные, затем откатить транзакцию",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(import_history(parse_args()))
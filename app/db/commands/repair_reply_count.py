@@ -0,0 +1,29 @@
+"""
+Пересчёт денормализованного счётчика ответов messages.reply_count.
+
+Запуск: python -m app.db.commands.repair_reply_count
+"""
+import asyncio
+import sys
+
+from app.v1.conversations.messages.repo import MessageRepository
+from misc import async_session
+from misc import engine
+
+
+async def repair_reply_count() -> None:
+    repo = MessageRepository(db_session=async_session)
+    try:
+        repaired = await repo.repair_reply_counts()
+    finally:
+        await engine.dispose()
+
+    # orm_error_handler возвращает None, если пересчёт не выполнен
+    if repaired is None:
+        print("Не удалось пересчитать reply_count", file=sys.stderr)
+        sys.exit(1)
+    print(f"Исправлен reply_count у {repaired} сообщений")
+
+
+if __name__ == "__main__":
+    asyncio.run(repair_reply_count())
@@ -0,0 +1,116 @@
+"""public chats discovery
+
+Revision ID: 3f1c8b0d27a9
+Revises: e440c7596a0c
+Create Date: 2026-10-18 15:42:10.218734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3f1c8b0d27a9'
+down_revision = 'e440c7596a0c'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 5000
+
+# Время в messages/conversations хранится по Москве без часового пояса
+SELECT_BATCH = sa.text(
+    """
+    select uuid from conversations
+    where uuid > :after
+    order by uuid
+    limit :batch_size
+    """
+)
+BACKFILL_BATCH = sa.text(
+    """
+    update conversations
+    set last_message_at = (
+        coalesce(latest.created_at, source.created_at)
+        at time zone 'Europe/Moscow'
+    )
+    from conversations source
+    left join lateral (
+        select max(m.created_at) as created_at
+        from messages m
+        where m.conversation_id = source.uuid
+          and m.parent_id is null
+    ) as latest on true
+    where conversations.uuid = source.uuid
+      and source.uuid between :first and :last
+      and coalesce(latest.created_at, source.created_at) is not null
+    """
+)
+
+# CREATE INDEX CONCURRENTLY нельзя выполнить внутри транзакции,
+# поэтому заполнение и индексы идут в autocommit_block: каждая пачка
+# фиксируется отдельно и не держит блокировку записи на всю таблицу.
+INDEXES = (
+    dict(
+        index_name='ix_conversations_public_last_message_at',
+        table_name='conversations',
+        columns=['last_message_at', 'uuid'],
+        postgresql_where=sa.text('type_id = 3'),
+    ),
+    dict(
+        index_name='ix_chats_title_lower',
+        table_name='chats',
+        columns=[sa.text('lower(title) text_pattern_ops')],
+    ),
+)
+
+
+def backfill_last_message_at() -> None:
+    connection = op.get_bind()
+    after = '00000000-0000-0000-0000-000000000000'
+    while True:
+        batch = connection.execute(
+            SELECT_BATCH,
+            dict(after=after, batch_size=BACKFILL_BATCH_SIZE),
+        ).scalars().all()
+        if not batch:
+            return
+        connection.execute(
+            BACKFILL_BATCH, dict(first=batch[0], last=batch[-1])
+        )
+        after = batch[-1]
+
+
+def upgrade() -> None:
+    # Значение по умолчанию now() стабильно, поэтому колонка добавляется
+    # без перезаписи таблицы
+    op.add_column(
+        'conversations',
+        sa.Column(
+            'last_message_at',
+            sa.DateTime(timezone=True),
+            server_default=sa.text('now()'),
+            nullable=False,
+            comment='Время последнего сообщения верхнего уровня',
+        )
+    )
+    with op.get_context().autocommit_block():
+        backfill_last_message_at()
+        for index in INDEXES:
+            op.create_index(
+                index['index_name'],
+                index['table_name'],
+                index['columns'],
+                unique=False,
+                postgresql_concurrently=True,
+                postgresql_where=index.get('postgresql_where'),
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for index in reversed(INDEXES):
+            op.drop_index(
+                index['index_name'],
+                table_name=index['table_name'],
+                postgresql_concurrently=True,
+            )
+    op.drop_column('conversations', 'last_message_at')
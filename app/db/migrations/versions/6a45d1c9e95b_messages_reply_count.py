@@ -0,0 +1,44 @@
+"""messages reply_count
+
+Revision ID: 6a45d1c9e95b
+Revises: 6e5d89f94a13
+Create Date: 2026-10-18 11:02:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '6a45d1c9e95b'
+down_revision = '6e5d89f94a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'messages',
+        sa.Column(
+            'reply_count',
+            sa.Integer(),
+            server_default='0',
+            nullable=False,
+            comment='Количество ответов в треде сообщения',
+        )
+    )
+    BACKFILL_REPLY_COUNT = """
+    update messages
+    set reply_count = replies.total
+    from (
+        select parent_id, count(*) as total
+        from messages
+        where parent_id is not null
+        group by parent_id
+    ) as replies
+    where messages.uuid = replies.parent_id;
+    """
+    op.execute(BACKFILL_REPLY_COUNT)
+
+
+def downgrade() -> None:
+    op.drop_column('messages', 'reply_count')
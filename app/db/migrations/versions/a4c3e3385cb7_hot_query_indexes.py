@@ -0,0 +1,75 @@
+"""hot query indexes
+
+Revision ID: a4c3e3385cb7
+Revises: 6a45d1c9e95b
+Create Date: 2026-10-18 12:40:07.551962
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a4c3e3385cb7'
+down_revision = '6a45d1c9e95b'
+branch_labels = None
+depends_on = None
+
+# CREATE INDEX CONCURRENTLY нельзя выполнить внутри транзакции,
+# поэтому индексы создаются в autocommit_block и не блокируют запись.
+INDEXES = (
+    dict(
+        index_name='ix_messages_conversation_id_parent_id_created_at',
+        table_name='messages',
+        columns=['conversation_id', 'parent_id', 'created_at'],
+    ),
+    dict(
+        index_name='ix_messages_conversation_id_uuid_root',
+        table_name='messages',
+        columns=['conversation_id', 'uuid'],
+        postgresql_where=sa.text('parent_id IS NULL'),
+    ),
+    dict(
+        index_name='ix_messages_parent_id_uuid',
+        table_name='messages',
+        columns=['parent_id', 'uuid'],
+        postgresql_where=sa.text('parent_id IS NOT NULL'),
+    ),
+    dict(
+        index_name='ix_users_conversations_user_id',
+        table_name='users_conversations',
+        columns=['user_id', 'conversation_id'],
+    ),
+    dict(
+        index_name='ix_conversations_type_id',
+        table_name='conversations',
+        columns=['type_id'],
+    ),
+    dict(
+        index_name='ix_messages_documents_message_id',
+        table_name='messages_documents',
+        columns=['message_id'],
+    ),
+)
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for index in INDEXES:
+            op.create_index(
+                index['index_name'],
+                index['table_name'],
+                index['columns'],
+                unique=False,
+                postgresql_concurrently=True,
+                postgresql_where=index.get('postgresql_where'),
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for index in reversed(INDEXES):
+            op.drop_index(
+                index['index_name'],
+                table_name=index['table_name'],
+                postgresql_concurrently=True,
+            )
@@ -0,0 +1,42 @@
+"""socket outbox
+
+Revision ID: b2d7e4a91c35
+Revises: 3f1c8b0d27a9
+Create Date: 2026-10-18 22:05:13.482615
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'b2d7e4a91c35'
+down_revision = '3f1c8b0d27a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'socket_outbox',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('event', sa.String(), nullable=False),
+        sa.Column('namespace', sa.String(), nullable=True),
+        sa.Column('room', sa.String(), nullable=True),
+        sa.Column(
+            'payload',
+            postgresql.JSONB(astext_type=sa.Text()),
+            nullable=False,
+        ),
+        sa.Column(
+            'created_at',
+            sa.DateTime(timezone=True),
+            server_default=sa.text('now()'),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('socket_outbox')
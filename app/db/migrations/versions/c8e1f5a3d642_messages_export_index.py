@@ -0,0 +1,35 @@
+"""messages export index
+
+Revision ID: c8e1f5a3d642
+Revises: b2d7e4a91c35
+Create Date: 2026-10-18 22:31:47.106254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c8e1f5a3d642'
+down_revision = 'b2d7e4a91c35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_conversation_id_created_at',
+            'messages',
+            ['conversation_id', 'created_at', 'uuid'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_messages_conversation_id_created_at',
+            table_name='messages',
+            postgresql_concurrently=True,
+        )
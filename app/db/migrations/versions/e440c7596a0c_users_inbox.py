@@ -0,0 +1,120 @@
+"""users inbox
+
+Revision ID: e440c7596a0c
+Revises: a4c3e3385cb7
+Create Date: 2026-10-18 14:18:52.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'e440c7596a0c'
+down_revision = 'a4c3e3385cb7'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+SELECT_BATCH = sa.text(
+    """
+    select distinct conversation_id from users_conversations
+    where conversation_id > :after
+    order by conversation_id
+    limit :batch_size
+    """
+)
+# Время в messages/conversations хранится по Москве без часового пояса
+BACKFILL_BATCH = sa.text(
+    """
+    insert into users_inbox (
+        user_id,
+        conversation_id,
+        last_message_id,
+        last_message_preview,
+        last_message_at,
+        last_read_message_id
+    )
+    select
+        uc.user_id,
+        uc.conversation_id,
+        last_message.uuid,
+        left(last_message.text, 255),
+        coalesce(
+            coalesce(
+                last_message.created_at,
+                c.created_at,
+                uc.created_at
+            ) at time zone 'Europe/Moscow',
+            now()
+        ),
+        last_message.uuid
+    from users_conversations uc
+    join conversations c on c.uuid = uc.conversation_id
+    left join lateral (
+        select m.uuid, m.text, m.created_at
+        from messages m
+        where m.conversation_id = uc.conversation_id
+          and m.parent_id is null
+        order by m.uuid desc
+        limit 1
+    ) as last_message on true
+    where uc.conversation_id between :first and :last
+    on conflict do nothing
+    """
+)
+
+
+def backfill_inbox() -> None:
+    """
+    Строки инбокса заполняются пачками по conversation_id, каждая пачка
+    фиксируется отдельно и не держит блокировки и WAL всей миграции
+    """
+    connection = op.get_bind()
+    after = '00000000-0000-0000-0000-000000000000'
+    while True:
+        batch = connection.execute(
+            SELECT_BATCH,
+            dict(after=after, batch_size=BACKFILL_BATCH_SIZE),
+        ).scalars().all()
+        if not batch:
+            return
+        connection.execute(
+            BACKFILL_BATCH, dict(first=batch[0], last=batch[-1])
+        )
+        after = batch[-1]
+
+
+def upgrade() -> None:
+    op.create_table(
+        'users_inbox',
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('conversation_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('last_message_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('last_message_preview', sa.String(length=255), nullable=True),
+        sa.Column(
+            'last_message_at',
+            sa.DateTime(timezone=True),
+            server_default=sa.text('now()'),
+            nullable=False,
+        ),
+        sa.Column('last_read_message_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversations.uuid'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['users.uuid'], ),
+        sa.PrimaryKeyConstraint('user_id', 'conversation_id')
+        )
+    op.create_index(
+        'ix_users_inbox_user_id_last_message_at',
+        'users_inbox',
+        ['user_id', 'last_message_at', 'conversation_id'],
+        unique=False
+        )
+    with op.get_context().autocommit_block():
+        backfill_inbox()
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_inbox_user_id_last_message_at', table_name='users_inbox')
+    op.drop_table('users_inbox')
@@ -1,19 +1,25 @@
 import enum
 
+from sqlalchemy import BigInteger
 from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import DateTime
 from sqlalchemy import Enum
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import Numeric
 from sqlalchemy import String
 from sqlalchemy import Text
+from sqlalchemy import func
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import declared_attr
 from sqlalchemy.orm import query_expression
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm import synonym
 from sqlalchemy.sql.functions import current_timestamp
 from uuid_extensions import uuid7
 
@@ -107,6 +113,14 @@ class ChatType(Base):
 
 class Chat(TimestampMixin, StatusMixin, Base):
     __tablename__ = "chats"
+    __table_args__ = (
+        # Поиск публичных чатов по началу названия без учёта регистра
+        Index(
+            "ix_chats_title_lower",
+            func.lower(text("title")).label("title_lower"),
+            postgresql_ops={"title_lower": "text_pattern_ops"},
+        ),
+    )
 
     uuid = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     title = Column(
@@ -122,6 +136,9 @@ class Chat(TimestampMixin, StatusMixin, Base):
 
 class ConversationUser(TimestampMixin, Base):
     __tablename__ = "users_conversations"
+    __table_args__ = (
+        Index("ix_users_conversations_user_id", "user_id", "conversation_id"),
+    )
 
     conversation_id = Column(
         UUID(as_uuid=True), ForeignKey("conversations.uuid"), primary_key=True
@@ -133,16 +150,36 @@ class ConversationUser(TimestampMixin, Base):
 
 class Conversation(TimestampMixin, Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        Index(
+            "ix_conversations_public_last_message_at",
+            "last_message_at",
+            "uuid",
+            postgresql_where=text("type_id = 3"),
+        ),
+    )
 
     uuid = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
-    type_id = Column(Integer, ForeignKey("chats_types.id"))
+    type_id = Column(Integer, ForeignKey("chats_types.id"), index=True)
     chat_id = Column(UUID(as_uuid=True), ForeignKey("chats.uuid"))
+    last_message_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        comment="Время последнего сообщения верхнего уровня",
+    )
 
     chat = relationship("Chat", viewonly=True, uselist=False)
     chat_type = relationship("ChatType", viewonly=True, lazy="joined")
     type = association_proxy("chat_type", attr="name")
+    # Строка инбокса текущего пользователя, загружается через contains_eager
+    inbox = relationship(
+        "ConversationInbox", viewonly=True, uselist=False, lazy="noload"
+    )
 
-    companion = query_expression()
+    # Не колонка: собеседник личного чата подставляется репозиторием
+    # пакетной загрузкой (ChatRepository._attach_companions)
+    companion = None
 
     # @declared_attr
     # def companion(self):
@@ -178,6 +215,57 @@ class Conversation(TimestampMixin, Base):
     #     )
 
 
+class ConversationInbox(Base):
+    """
+    Проекция списка чатов пользователя: последнее сообщение и счётчик
+    непрочитанных поддерживаются при записи сообщений.
+    """
+
+    __tablename__ = "users_inbox"
+    __table_args__ = (
+        Index(
+            "ix_users_inbox_user_id_last_message_at",
+            "user_id",
+            "last_message_at",
+            "conversation_id",
+        ),
+    )
+
+    user_id = Column(
+        UUID(as_uuid=True), ForeignKey("users.uuid"), primary_key=True
+    )
+    conversation_id = Column(
+        UUID(as_uuid=True), ForeignKey("conversations.uuid"), primary_key=True
+    )
+    last_message_id = Column(UUID(as_uuid=True), nullable=True)
+    last_message_preview = Column(String(255), nullable=True)
+    last_message_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    last_read_message_id = Column(UUID(as_uuid=True), nullable=True)
+    unread_count = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+
+
+class SocketOutbox(Base):
+    """
+    События сокета, записанные в одной транзакции с изменением данных.
+    Публикуются в Redis фоновым SocketOutboxDispatcher и удаляются.
+    """
+
+    __tablename__ = "socket_outbox"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    event = Column(String, nullable=False)
+    namespace = Column(String, nullable=True)
+    room = Column(String, nullable=True)
+    payload = Column(JSONB, nullable=False)
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+
 class SessionDevice(Base):
     __tablename__ = "sessions_devices"
     uuid = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
@@ -222,7 +310,10 @@ class MessageDocument(Base):
     uuid = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
 
     message_id = Column(
-        UUID(as_uuid=True), ForeignKey("messages.uuid"), primary_key=True
+        UUID(as_uuid=True),
+        ForeignKey("messages.uuid"),
+        primary_key=True,
+        index=True,
     )
     document_id = Column(
         UUID(as_uuid=True), ForeignKey("documents.uuid"), primary_key=True
@@ -234,6 +325,33 @@ class MessageDocument(Base):
 
 class Message(TimestampMixin, Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index(
+            "ix_messages_conversation_id_parent_id_created_at",
+            "conversation_id",
+            "parent_id",
+            "created_at",
+        ),
+        Index(
+            "ix_messages_conversation_id_uuid_root",
+            "conversation_id",
+            "uuid",
+            postgresql_where=text("parent_id IS NULL"),
+        ),
+        Index(
+            "ix_messages_parent_id_uuid",
+            "parent_id",
+            "uuid",
+            postgresql_where=text("parent_id IS NOT NULL"),
+        ),
+        # Выгрузка истории чата по времени создания
+        Index(
+            "ix_messages_conversation_id_created_at",
+            "conversation_id",
+            "created_at",
+            "uuid",
+        ),
+    )
     uuid = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     conversation_id = Column(
         UUID(as_uuid=True), ForeignKey("conversations.uuid"), primary_key=True
@@ -250,9 +368,17 @@ class Message(TimestampMixin, Base):
         nullable=True,
     )
 
+    reply_count = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+        comment="Количество ответов в треде сообщения",
+    )
+
     documents = relationship("Document", secondary="messages_documents", uselist=True)
 
     parent = relationship("Message", remote_side=[uuid])
     author = relationship("User")
 
-    thread_count = query_expression()
+    thread_count = synonym("reply_count")
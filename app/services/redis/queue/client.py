@@ -1,11 +1,35 @@
 from typing import Any
+
+from prometheus_client import Gauge
 from socketio import AsyncRedisManager
 
+from app.services.redis.queue.managers import BatchRedisManager
+
+socket_queue_pool_connections = Gauge(
+    "socket_queue_pool_connections",
+    "Соединения пула Redis для публикации событий сокета",
+    ["state"],
+)
+
 
 class RedisSocketQueue:
+    """
+    Публикатор событий сокета. Создаётся один раз на приложение и
+    переиспользует пул соединений AsyncRedisManager.
+    """
+
     def __init__(self, mgr: AsyncRedisManager):
         self.mgr = mgr
 
+        # Пул читается через mgr.redis: менеджер пересоздаёт клиента
+        # после ошибки публикации
+        socket_queue_pool_connections.labels(state="in_use").set_function(
+            lambda: len(self.mgr.redis.connection_pool._in_use_connections)
+        )
+        socket_queue_pool_connections.labels(state="available").set_function(
+            lambda: len(self.mgr.redis.connection_pool._available_connections)
+        )
+
     async def emit(
         self,
         event: str,
@@ -25,3 +49,21 @@ class RedisSocketQueue:
             callback=callback,
             **kwargs
         )
+
+    async def flush(self) -> bool:
+        """
+        Немедленная публикация накопленных событий
+        :return: False, если с прошлого вызова часть событий не
+            опубликована
+        """
+        if isinstance(self.mgr, BatchRedisManager):
+            return await self.mgr.flush()
+        return True
+
+    async def close(self) -> None:
+        if isinstance(self.mgr, BatchRedisManager):
+            await self.mgr.close()
+            return
+
+        await self.mgr.redis.close()
+        await self.mgr.redis.connection_pool.disconnect()
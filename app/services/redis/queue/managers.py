@@ -0,0 +1,130 @@
+import asyncio
+import pickle
+import time
+from typing import Any
+from typing import Optional
+
+from prometheus_client import Histogram
+from socketio import AsyncRedisManager
+
+socket_queue_publish_seconds = Histogram(
+    "socket_queue_publish_seconds",
+    "Время публикации события сокета в Redis",
+    ["event"],
+)
+socket_queue_batch_size = Histogram(
+    "socket_queue_batch_size",
+    "Количество событий сокета в одной публикации",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200),
+)
+
+BATCH_METHOD = "batch"
+
+
+class BatchRedisManager(AsyncRedisManager):
+    """
+    AsyncRedisManager, который копит события до batch_window секунд или
+    batch_size штук и публикует их одним сообщением
+    {"method": "batch", "messages": [...]}. Одиночное событие уходит без
+    обёртки, поэтому обычные подписчики его тоже понимают.
+
+    На стороне подписчика пакет распаковывается в _listen, и каждое
+    событие обрабатывается штатным _thread.
+
+    Пачка может уйти и без явного flush: при заполнении или по таймеру.
+    Неудачная публикация запоминается, и ближайший flush вернёт False.
+    """
+
+    name = "aioredis-batch"
+
+    def __init__(
+        self,
+        *args,
+        batch_window: float = 0.005,
+        batch_size: int = 100,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self._buffer: list[dict[str, Any]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._publish_failed = False
+
+    async def _publish(self, data: dict[str, Any]):
+        if self.batch_size <= 1 or self.batch_window <= 0:
+            return await self._publish_checked(data)
+
+        self._buffer.append(data)
+        if len(self._buffer) >= self.batch_size:
+            await self._flush_buffer()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.batch_window)
+        try:
+            await self._flush_buffer()
+        except Exception:
+            self._publish_failed = True
+            self._get_logger().exception("Cannot flush socket batch")
+
+    async def flush(self) -> bool:
+        """
+        Опубликовать накопленные события
+        :return: False, если с прошлого вызова flush хотя бы одно событие
+            не опубликовано, в том числе в пачке, ушедшей без flush
+        """
+        await self._flush_buffer()
+        failed, self._publish_failed = self._publish_failed, False
+        return not failed
+
+    async def _flush_buffer(self) -> None:
+        messages, self._buffer = self._buffer, []
+        if not messages:
+            return
+
+        socket_queue_batch_size.observe(len(messages))
+        if len(messages) == 1:
+            await self._publish_checked(messages[0])
+        else:
+            await self._publish_checked(
+                {"method": BATCH_METHOD, "messages": messages}
+            )
+
+    async def _publish_checked(self, data: dict[str, Any]):
+        published = await self._publish_now(data)
+        # AsyncRedisManager._publish возвращает None, когда сдался
+        if published is None:
+            self._publish_failed = True
+        return published
+
+    async def _publish_now(self, data: dict[str, Any]):
+        started_at = time.perf_counter()
+        try:
+            return await super()._publish(data)
+        finally:
+            socket_queue_publish_seconds.labels(
+                event=data.get("event") or data["method"]
+            ).observe(time.perf_counter() - started_at)
+
+    async def _listen(self):
+        async for message in super()._listen():
+            try:
+                data = pickle.loads(message)
+            except Exception:
+                yield message
+                continue
+
+            if isinstance(data, dict) and data.get("method") == BATCH_METHOD:
+                for element in data.get("messages", []):
+                    yield element
+            else:
+                yield data
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        await self.redis.close()
+        await self.redis.connection_pool.disconnect()
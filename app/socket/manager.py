@@ -0,0 +1,143 @@
+from typing import Any
+from typing import Optional
+from uuid import UUID
+
+import socketio
+from fastapi import HTTPException
+from socketio.exceptions import ConnectionRefusedError
+from sqlalchemy.orm import sessionmaker
+
+from app.services.redis.queue.managers import BatchRedisManager
+from app.socket.rooms import SOCKET_NAMESPACE
+from app.socket.rooms import conversation_room
+from app.socket.rooms import user_room
+from app.v1.conversations.chats.repo import ChatRepository
+from app.v1.security.auth import verify_token
+from app.v1.statuses.enums import StatusEnum
+from app.v1.users.services import UserService
+from config import settings_redis
+from misc import async_session
+
+
+class ConversationNamespace(socketio.AsyncNamespace):
+    """
+    Шлюз событий чатов. При подключении клиент проходит проверку JWT и
+    попадает в комнату пользователя и комнаты всех своих чатов, поэтому
+    получает только события этих чатов.
+
+    Репозитории создаются на каждый обработчик, как зависимости в HTTP:
+    BaseCRUD держит одну сессию, а обработчики разных клиентов
+    выполняются конкурентно.
+    """
+
+    def __init__(self, namespace: str, db_session: sessionmaker):
+        super().__init__(namespace=namespace)
+        self.db_session = db_session
+
+    async def on_connect(
+        self,
+        sid: str,
+        environ: dict[str, Any],
+        auth: Optional[dict[str, Any]] = None,
+    ):
+        token = self._get_token(environ=environ, auth=auth)
+        if not token:
+            raise ConnectionRefusedError("unauthorized")
+
+        try:
+            user_uuid, _ = verify_token(token=token)
+            user = await UserService(
+                db_session=self.db_session
+            ).get_current_from_uuid(user_uuid)
+        except HTTPException:
+            raise ConnectionRefusedError("unauthorized")
+
+        if user is None or user.status_id != StatusEnum.ACTIVE:
+            raise ConnectionRefusedError("unauthorized")
+
+        conversation_ids = await ChatRepository(
+            db_session=self.db_session
+        ).get_conversation_ids(user_uuid=user.uuid)
+        # None - ошибка базы: без комнат чатов клиент молча пропускал бы
+        # события, поэтому он переподключится
+        if conversation_ids is None:
+            raise ConnectionRefusedError("unavailable")
+
+        await self.save_session(sid, {"user_id": user.uuid})
+        self.enter_room(sid, user_room(user.uuid))
+        for conversation_id in conversation_ids:
+            self.enter_room(sid, conversation_room(conversation_id))
+
+    async def on_subscribe(self, sid: str, data: dict[str, Any]):
+        """
+        Подписка на чат, в который пользователь вступил после подключения,
+        или на публичный чат
+        """
+        conversation_id = self._get_conversation_id(data=data)
+        if conversation_id is None:
+            return {"ok": False}
+
+        session = await self.get_session(sid)
+        chat_repo = ChatRepository(db_session=self.db_session)
+        if not await chat_repo.can_subscribe(
+            user_uuid=session["user_id"], chat_uuid=conversation_id
+        ):
+            return {"ok": False}
+
+        self.enter_room(sid, conversation_room(conversation_id))
+        return {"ok": True}
+
+    async def on_unsubscribe(self, sid: str, data: dict[str, Any]):
+        conversation_id = self._get_conversation_id(data=data)
+        if conversation_id is None:
+            return {"ok": False}
+
+        self.leave_room(sid, conversation_room(conversation_id))
+        return {"ok": True}
+
+    @staticmethod
+    def _get_token(
+        environ: dict[str, Any], auth: Optional[dict[str, Any]]
+    ) -> Optional[str]:
+        if isinstance(auth, dict) and auth.get("token"):
+            return auth["token"]
+        return environ.get("HTTP_AUTHORIZATION")
+
+    @staticmethod
+    def _get_conversation_id(data: Any) -> Optional[UUID]:
+        if not isinstance(data, dict):
+            return None
+        try:
+            return UUID(str(data.get("conversation_id")))
+        except ValueError:
+            return None
+
+
+def get_socket_server() -> socketio.AsyncServer:
+    server = socketio.AsyncServer(
+        async_mode="asgi",
+        cors_allowed_origins="*",
+        client_manager=BatchRedisManager(
+            url=settings_redis.dsn(
+                host=settings_redis.REDIS_HOST,
+                port=settings_redis.REDIS_PORT,
+                database=settings_redis.REDIS_DB_QUEUE,
+                user=settings_redis.REDIS_USER,
+                password=settings_redis.REDIS_PWD,
+            ),
+            channel=settings_redis.REDIS_DB_QUEUE_CHANNEL,
+            batch_window=settings_redis.REDIS_QUEUE_BATCH_WINDOW,
+            batch_size=settings_redis.REDIS_QUEUE_BATCH_SIZE,
+        ),
+    )
+    server.register_namespace(
+        ConversationNamespace(SOCKET_NAMESPACE, db_session=async_session)
+    )
+    return server
+
+
+async def close_socket_server(server: socketio.AsyncServer) -> None:
+    listener = getattr(server.manager, "thread", None)
+    if listener is not None:
+        listener.cancel()
+    await server.manager.close()
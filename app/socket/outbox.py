@@ -0,0 +1,139 @@
+import asyncio
+import logging
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import NamedTuple
+from typing import Optional
+
+from prometheus_client import Counter
+from sqlalchemy import delete
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.db.crud.base import BaseCRUD
+from app.db.models import SocketOutbox
+from app.services.redis.queue.client import RedisSocketQueue
+
+logger = logging.getLogger(__name__)
+
+socket_outbox_dispatched_total = Counter(
+    "socket_outbox_dispatched_total",
+    "События сокета, опубликованные из outbox",
+)
+
+
+class SocketEvent(NamedTuple):
+    event: str
+    data: Any
+    namespace: Optional[str] = None
+    room: Optional[str] = None
+
+
+# Строит события по результату записи внутри той же транзакции
+SocketEventsFactory = Callable[
+    [Any, AsyncSession], Awaitable[list[SocketEvent]]
+]
+
+
+class SocketOutboxDispatcher:
+    """
+    Фоновая отправка событий из socket_outbox в Redis.
+
+    Строки забираются пачками через FOR UPDATE SKIP LOCKED, поэтому
+    несколько процессов разбирают outbox без двойной отправки. Строки
+    удаляются в той же транзакции только после успешной публикации:
+    доставка "хотя бы один раз", при сбое Redis пачка отправится повторно.
+    """
+
+    def __init__(
+        self,
+        db_session: sessionmaker,
+        queue: RedisSocketQueue,
+        batch_size: int = 100,
+        poll_interval: float = 0.5,
+    ):
+        self.base = BaseCRUD(db_session=db_session, model=SocketOutbox)
+        self.queue = queue
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self) -> None:
+        """
+        Отправить события сразу, не дожидаясь poll_interval. Вызывается
+        после коммита в этом же процессе
+        """
+        self._wakeup.set()
+
+    async def start(self) -> None:
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """
+        Пачка, которая уже отправляется, дописывается до конца
+        """
+        if self._task is None:
+            return
+        self._closing = True
+        self.wake()
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        while not self._closing:
+            self._wakeup.clear()
+            try:
+                dispatched = await self.dispatch()
+            except Exception:
+                logger.exception("socket outbox dispatch failed")
+                dispatched = 0
+
+            if dispatched < self.batch_size:
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), timeout=self.poll_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+    async def dispatch(self) -> int:
+        """
+        :return: Количество отправленных событий
+        """
+        stmt = (
+            select(SocketOutbox)
+            .order_by(SocketOutbox.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+
+        async with self.base.transaction_v2() as transaction:
+            curr = await transaction.execute(stmt)
+            rows = curr.scalars().all()
+            if not rows:
+                return 0
+
+            for row in rows:
+                await self.queue.emit(
+                    row.event,
+                    row.payload,
+                    namespace=row.namespace,
+                    room=row.room,
+                )
+            if not await self.queue.flush():
+                raise ConnectionError("Redis недоступен")
+
+            await transaction.execute(
+                delete(SocketOutbox).where(
+                    SocketOutbox.id.in_([row.id for row in rows])
+                )
+            )
+            await transaction.commit()
+
+        socket_outbox_dispatched_total.inc(len(rows))
+        return len(rows)
@@ -0,0 +1,11 @@
+from uuid import UUID
+
+SOCKET_NAMESPACE = "/v1"
+
+
+def conversation_room(conversation_id: UUID) -> str:
+    return f"conversation:{conversation_id}"
+
+
+def user_room(user_id: UUID) -> str:
+    return f"user:{user_id}"
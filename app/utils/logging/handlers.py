@@ -0,0 +1,148 @@
+import logging
+import sys
+import threading
+from collections import deque
+from enum import Enum
+from typing import Optional
+from typing import TextIO
+
+from prometheus_client import Counter
+
+log_records_flushed_total = Counter(
+    "log_records_flushed_total",
+    "Записи журнала, записанные в поток или файл",
+)
+log_records_dropped_total = Counter(
+    "log_records_dropped_total",
+    "Отброшенные записи журнала",
+    ["reason"],
+)
+
+
+class OverflowPolicy(str, Enum):
+    # Новая запись вытесняет самую старую
+    DROP_OLDEST = "drop_oldest"
+    # Из записей, пришедших при полном буфере, сохраняется каждая
+    # sample_every-я, ошибки сохраняются всегда
+    SAMPLE = "sample"
+
+
+class BufferedLogHandler(logging.Handler):
+    """
+    Обработчик журнала с ограниченным кольцевым буфером.
+
+    Запись форматируется в потоке вызова (там доступен контекст
+    трассировки), а в поток вывода или файл строки пишет фоновый поток
+    пачками по batch_size или раз в flush_interval секунд. Если вывод не
+    успевает, буфер не растёт больше capacity: лишние записи
+    отбрасываются по overflow_policy и учитываются в
+    log_records_dropped_total.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+        overflow_policy: str = OverflowPolicy.DROP_OLDEST,
+        sample_every: int = 10,
+        filename: Optional[str] = None,
+        stream: Optional[TextIO] = None,
+        level: int = logging.NOTSET,
+    ):
+        super().__init__(level=level)
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self.sample_every = max(sample_every, 1)
+        if filename:
+            self.stream = open(filename, "a", encoding="utf-8")
+            self._owns_stream = True
+        else:
+            self.stream = stream or sys.stdout
+            self._owns_stream = False
+
+        self._buffer: deque[str] = deque()
+        self._ready = threading.Condition(threading.Lock())
+        self._overflow_seen = 0
+        self._closing = False
+        self._writer = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+        self._writer.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            line = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        with self._ready:
+            if self._closing:
+                log_records_dropped_total.labels(reason="closed").inc()
+                return
+            if len(self._buffer) >= self.capacity:
+                if not self._admit_on_overflow(record):
+                    log_records_dropped_total.labels(reason="overflow").inc()
+                    return
+                self._buffer.popleft()
+                log_records_dropped_total.labels(reason="overflow").inc()
+            self._buffer.append(line)
+            if len(self._buffer) >= self.batch_size:
+                self._ready.notify()
+
+    def _admit_on_overflow(self, record: logging.LogRecord) -> bool:
+        if self.overflow_policy == OverflowPolicy.DROP_OLDEST:
+            return True
+        if record.levelno >= logging.ERROR:
+            return True
+        self._overflow_seen += 1
+        return self._overflow_seen % self.sample_every == 0
+
+    def flush(self) -> None:
+        """
+        Разбудить фоновый поток, не дожидаясь flush_interval
+        """
+        with self._ready:
+            self._ready.notify()
+
+    def close(self) -> None:
+        """
+        Остаток буфера дописывается до закрытия
+        """
+        with self._ready:
+            self._closing = True
+            self._ready.notify()
+        self._writer.join()
+        if self._owns_stream:
+            self.stream.close()
+        super().close()
+
+    def _run(self) -> None:
+        while True:
+            with self._ready:
+                if not self._closing and len(self._buffer) < self.batch_size:
+                    self._ready.wait(timeout=self.flush_interval)
+                batch = [
+                    self._buffer.popleft()
+                    for _ in range(min(len(self._buffer), self.batch_size))
+                ]
+                closing = self._closing
+
+            if batch:
+                self._write(batch)
+            elif closing:
+                return
+
+    def _write(self, batch: list[str]) -> None:
+        try:
+            self.stream.write("\n".join(batch) + "\n")
+            self.stream.flush()
+        except Exception:
+            log_records_dropped_total.labels(reason="write_error").inc(
+                len(batch)
+            )
+        else:
+            log_records_flushed_total.inc(len(batch))
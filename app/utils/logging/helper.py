@@ -1,27 +1,67 @@
 import re
+from typing import Any
+from typing import Iterable
+
 from config import settings_sensus_app
 
 
-def mask_string(
-    source_string: str,
-) -> str:
+class SensitiveDataMasker:
+    """
+    Маскирование уязвимых данных в структуре лога. Значение скрывается
+    целиком, если ключ на любой глубине содержит одно из ключевых слов
+    (без учёта регистра), даже если это словарь или список. Под остальными
+    ключами словари и списки обходятся рекурсивно.
+    Паттерн компилируется один раз, проверки ключей кэшируются
+    """
+
+    MASK = "***"
+    # Ключи приходят и из тел запросов, поэтому кэш ограничен
+    CACHE_SIZE = 4096
+
+    def __init__(self, key_words: Iterable[str]):
+        self._pattern = re.compile(
+            "|".join(re.escape(word) for word in key_words), re.IGNORECASE
+        )
+        self._cache: dict[str, bool] = {}
+
+    def is_sensitive(self, key: str) -> bool:
+        sensitive = self._cache.get(key)
+        if sensitive is None:
+            if len(self._cache) >= self.CACHE_SIZE:
+                self._cache.clear()
+            sensitive = self._pattern.search(key) is not None
+            self._cache[key] = sensitive
+        return sensitive
+
+    def mask(self, value: Any) -> Any:
+        """
+        :param value: Словарь, список или значение из лога, не изменяется
+        :return: Копия со скрытыми уязвимыми данными
+        """
+        if isinstance(value, dict):
+            masked = {}
+            for key, item in value.items():
+                if item is not None and self.is_sensitive(str(key)):
+                    masked[key] = self.MASK
+                elif isinstance(item, (dict, list)):
+                    masked[key] = self.mask(item)
+                else:
+                    masked[key] = item
+            return masked
+        if isinstance(value, list):
+            return [self.mask(item) for item in value]
+        return value
+
+
+sensitive_data_masker = SensitiveDataMasker(
+    key_words=settings_sensus_app.DEFAULT_SENSITIVE_KEY_WORDS
+)
+
+
+def mask_data(source: dict) -> dict:
     """
-    Маскирование уязвимых данных по ключам в строке.
-    :param source_string: Оригинал строки,
-    :return: Строка со скрытыми уязвимыми данными
+    Маскирование уязвимых данных по ключам в объекте журнала.
+    :param source: Оригинал объекта журнала
+    :return: Объект со скрытыми уязвимыми данными
     """
-    # Подготовка паттерна поиска
-
-    regex_str = r'("[^"]*?(?={keywords})[^"]*":\s*")[^"]*"'
-    regex_with_keys = regex_str.format(
-        keywords="|".join(settings_sensus_app.DEFAULT_SENSITIVE_KEY_WORDS)
-    )
-    regex_pattern = re.compile(regex_with_keys)
-    subst = r'\1***"'
-
-    result = re.sub(
-        regex_pattern,
-        repl=subst,
-        string=source_string,
-    )
-    return result
+    return sensitive_data_masker.mask(source)
@@ -2,14 +2,13 @@ import datetime
 import json
 import logging
 import traceback
-from typing import Union
+from typing import Optional
 
 from opencensus.trace import execution_context, Span
 
 from config import settings_app
 from config import settings_sensus_app
-from app.utils.logging.helper import mask_string
-from app.utils.logging.schemas import BaseJsonLogSchema
+from app.utils.logging.helper import mask_data
 
 LEVEL_TO_NAME = {
     logging.CRITICAL: "Critical",
@@ -24,12 +23,24 @@ EMPTY_VALUE = ""
 
 class JSONLogFormatter(logging.Formatter):
     """
-    Кастомизированный класс-форматер для логов в формате json
+    Кастомизированный класс-форматер для логов в формате json.
+
+    Поля собираются в обычный словарь в порядке BaseJsonLogSchema,
+    постоянные поля и отметка времени текущей секунды кэшируются.
+    Замаскированные и обычные записи одинаково сериализуются в JSON
     """
 
-    def format(
-        self, record: logging.LogRecord, *args, **kwargs
-    ) -> Union[dict, str]:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._encoder = json.JSONEncoder(ensure_ascii=False)
+        self._app_fields = {
+            "app_name": settings_app.APP_NAME,
+            "app_version": settings_app.APP_VERSION,
+        }
+        self._timestamp_second: Optional[int] = None
+        self._timestamp: str = EMPTY_VALUE
+
+    def format(self, record: logging.LogRecord, *args, **kwargs) -> str:
         """
         Преобразование объект журнала в json
 
@@ -40,14 +51,21 @@ class JSONLogFormatter(logging.Formatter):
         log_object: dict = self._format_log_object(record)
 
         if settings_sensus_app.AUTO_MASK_LOGS and to_mask:
-            return mask_string(
-                source_string=json.dumps(log_object, ensure_ascii=False),
+            log_object = mask_data(log_object)
+        return self._encoder.encode(log_object)
+
+    def _format_timestamp(self, created: float) -> str:
+        second = int(created)
+        if second != self._timestamp_second:
+            self._timestamp = (
+                datetime.datetime.fromtimestamp(second)
+                .astimezone()
+                .isoformat()
             )
-        else:
-            return log_object
+            self._timestamp_second = second
+        return self._timestamp
 
-    @staticmethod
-    def _format_log_object(record: logging.LogRecord) -> dict:
+    def _format_log_object(self, record: logging.LogRecord) -> dict:
         """
         Перевод записи объекта журнала
         в json формат с необходимым перечнем полей
@@ -55,39 +73,31 @@ class JSONLogFormatter(logging.Formatter):
         :param record: объект журнала
         :return: Словарь с объектами журнала
         """
-        now = (
-            datetime.datetime.fromtimestamp(record.created)
-            .astimezone()
-            .replace(microsecond=0)
-            .isoformat()
-        )
-        message = record.getMessage()
         duration = (
             record.duration if hasattr(record, "duration") else record.msecs
         )
 
-        json_log_fields = BaseJsonLogSchema(
-            thread=record.process,
-            timestamp=now,
-            level=record.levelno,
-            level_name=LEVEL_TO_NAME[record.levelno],
-            message=message,
-            source=record.name,
-            duration=duration,
-            app_name=settings_app.APP_NAME,
-            app_version=settings_app.APP_VERSION,
-        )
+        json_log_object = {
+            "thread": record.process,
+            "level": record.levelno,
+            "level_name": LEVEL_TO_NAME[record.levelno],
+            "message": record.getMessage(),
+            "source": record.name,
+            "@timestamp": self._format_timestamp(record.created),
+            **self._app_fields,
+            "duration": int(duration),
+        }
 
         if hasattr(record, "props"):
-            json_log_fields.props = record.props
+            json_log_object["props"] = record.props
 
         if record.exc_info:
-            json_log_fields.exceptions = traceback.format_exception(
+            json_log_object["exceptions"] = traceback.format_exception(
                 *record.exc_info
             )
 
         elif record.exc_text:
-            json_log_fields.exceptions = record.exc_text
+            json_log_object["exceptions"] = record.exc_text
 
         # Работа с телеметрией и трассировкой
         span: Span = (
@@ -97,22 +107,14 @@ class JSONLogFormatter(logging.Formatter):
         )
 
         if span:
-            json_log_fields.trace_id = span.context_tracer.trace_id
-            json_log_fields.span_id = span.span_id
-            json_log_fields.parent_id = (
+            json_log_object["trace_id"] = span.context_tracer.trace_id
+            json_log_object["span_id"] = span.span_id
+            json_log_object["parent_id"] = (
                 span.parent_span.span_id if span.parent_span else None
             )
 
-        json_log_object = json_log_fields.dict(
-            exclude_unset=True,
-            by_alias=True,
-        )
         # Соединение дополнительных полей логирования
         if hasattr(record, "request_json_fields"):
             json_log_object.update(record.request_json_fields)
 
         return json_log_object
-
-
-def write_log(msg):
-    print(msg)
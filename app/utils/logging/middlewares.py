@@ -3,11 +3,10 @@ import json
 import logging
 import math
 import time
-from io import BytesIO
-from typing import Self
+from typing import Optional
+from typing import Union
 
 from fastapi import Request
-from fastapi import Response
 from opencensus.common.transports import sync
 from opencensus.trace import attributes_helper
 from opencensus.trace import execution_context
@@ -17,13 +16,16 @@ from opencensus.trace import tracer as tracer_module
 from opencensus.trace import utils
 from opencensus.trace.base_exporter import Exporter
 from opencensus.trace.propagation import trace_context_http_header_format
-from starlette.middleware.base import RequestResponseEndpoint
+from starlette.datastructures import Headers
 from starlette.types import ASGIApp
 from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
 
 from app.exceptions.cors import handle_custom_500_with_cors
 from app.utils.logging.json_logger import EMPTY_VALUE
-from app.utils.logging.schemas import RequestJsonLogSchema
+from app.utils.logging.sampling import RequestSamplingPolicy
 from config import settings_app
 
 HTTP_HOST = attributes_helper.COMMON_ATTRIBUTES["HTTP_HOST"]
@@ -35,25 +37,9 @@ HTTP_STATUS_CODE = attributes_helper.COMMON_ATTRIBUTES["HTTP_STATUS_CODE"]
 
 logger = logging.getLogger(__name__)
 
-
-class AsyncIteratorWrapper:
-    """
-    Small helper to turn BytesIO into async-able iterator
-    """
-
-    def __init__(self, bytes_: bytes):
-        super().__init__()
-        self._it = BytesIO(bytes_)
-
-    def __aiter__(self) -> Self:
-        return self
-
-    async def __anext__(self) -> bytes:
-        try:
-            value = next(self._it)
-        except StopIteration:
-            raise StopAsyncIteration
-        return value
+# Тела больше лимита не попадают в журнал
+LOG_BODY_LIMIT = 10000
+LARGE_BODY = {"sys-info": "Request/Response size is very large"}
 
 
 class DefaultExporter(Exporter):
@@ -88,128 +74,187 @@ class DefaultExporter(Exporter):
         self.transport.export(span_datas)
 
 
+class DeferredExporter(Exporter):
+    """
+    Копит спаны одного запроса вне выборки, пока не станет ясно,
+    нужно ли их экспортировать
+    """
+
+    def __init__(self):
+        self.span_datas = []
+
+    def emit(self, span_datas):
+        pass
+
+    def export(self, span_datas):
+        self.span_datas.extend(span_datas)
+
+
+class BodyTee:
+    """
+    Копия начала тела запроса или ответа для журнала. Хранится не больше
+    limit байт, поэтому большие и потоковые тела не накапливаются в памяти
+    """
+
+    def __init__(self, limit: int, enabled: bool = False):
+        self.limit = limit
+        self.enabled = enabled
+        self.size = 0
+        self._buffer = bytearray()
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.enabled and len(self._buffer) <= self.limit:
+            self._buffer += chunk[: self.limit + 1 - len(self._buffer)]
+
+    def value(self, declared_size: int) -> Union[str, dict, list]:
+        if not self.enabled:
+            return EMPTY_VALUE
+        if declared_size > self.limit or self.size > self.limit:
+            return LARGE_BODY
+        try:
+            return json.loads(self._buffer)
+        except ValueError:
+            return self._buffer.decode(errors="replace")
+
+
 class LoggingMiddleware:
     """
-    Middleware для обработки запросов и ответов с целью журналирования
+    ASGI middleware для журналирования запросов и ответов.
+
+    Сообщения передаются приложению и клиенту без изменений, в журнал
+    копируются только первые body_limit байт JSON-тел. Тела больше
+    лимита не разбираются, вместо них пишется LARGE_BODY. Без policy
+    журналируются все запросы
     """
 
+    def __init__(
+        self,
+        app: ASGIApp,
+        body_limit: int = LOG_BODY_LIMIT,
+        policy: Optional[RequestSamplingPolicy] = None,
+    ):
+        self.app = app
+        self.body_limit = body_limit
+        self.policy = policy
+
     @staticmethod
-    async def get_protocol(request: Request) -> str:
-        protocol = str(request.scope.get("type", ""))
-        http_version = str(request.scope.get("http_version", ""))
+    def get_protocol(scope: Scope) -> str:
+        protocol = str(scope.get("type", ""))
+        http_version = str(scope.get("http_version", ""))
         if protocol.lower() == "http" and http_version:
             return f"{protocol.upper()}/{http_version}"
         return EMPTY_VALUE
 
-    @staticmethod
-    async def set_body(request: Request, body: bytes) -> None:
-        async def receive() -> Message:
-            return {"type": "http.request", "body": body}
-
-        request._receive = receive
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-    async def get_body(self, request: Request) -> bytes:
-        body = await request.body()
-        await self.set_body(request, body)
-        return body
-
-    async def __call__(
-        self,
-        request: Request,
-        call_next: RequestResponseEndpoint,
-        *args,
-        **kwargs,
-    ):
         start_time = time.time()
         exception_object = None
-        request_body = EMPTY_VALUE
-        request_content_type = request.headers.get("Content-Type", EMPTY_VALUE)
-        # Request Side
-        try:
-            if "application/json" == request_content_type:
-                raw_request_body = await request.body()
-                await self.set_body(request, raw_request_body)
-                raw_request_body = await self.get_body(request)
-                request_body = raw_request_body.decode()
-
-        except AttributeError:
-            request_body = EMPTY_VALUE
-        try:
-            if request_body != EMPTY_VALUE:
-                request_body = json.loads(request_body)
-        except json.decoder.JSONDecodeError:
-            pass
+        # Для запросов вне выборки тела не копируются вовсе
+        sampled = self.policy is None or self.policy.is_sampled(scope)
+        request = Request(scope)
+        request_body = BodyTee(
+            limit=self.body_limit,
+            enabled=sampled
+            and request.headers.get("content-type") == "application/json",
+        )
+        response_body = BodyTee(limit=self.body_limit)
+        response_status_code: int = http.HTTPStatus.INTERNAL_SERVER_ERROR.value
+        response_raw_headers: list = []
+        response_started = False
+
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                request_body.write(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_status_code, response_raw_headers
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+                response_status_code = message["status"]
+                response_raw_headers = message.get("headers", [])
+                response_body.enabled = (
+                    sampled
+                    and Headers(raw=response_raw_headers).get("content-type")
+                    == "application/json"
+                )
+            elif (
+                message["type"] == "http.response.body"
+                and response_body.enabled
+            ):
+                response_body.write(message.get("body", b""))
+            await send(message)
 
-        server: tuple = request.get("server", ("localhost", settings_app.PORT))
-        request_headers: dict = dict(request.headers.items())
-        # Response Side
         try:
-            response = await call_next(request)
-        except Exception as ex:
-            response_body = bytes(
-                http.HTTPStatus.INTERNAL_SERVER_ERROR.phrase.encode()
+            await self.app(
+                scope,
+                receive_wrapper if request_body.enabled else receive,
+                send_wrapper,
             )
-            response = handle_custom_500_with_cors(request=request)
+        except Exception as ex:
             exception_object = ex
-            response_headers = {}
-        else:
-            response_headers = dict(response.headers.items())
-            response_body = b""
-            async for chunk in response.body_iterator:
-                response_body += chunk
-            response = Response(
-                content=response_body,
-                status_code=response.status_code,
-                headers=dict(response.headers),
-                media_type=response.media_type,
-            )
+            if not response_started:
+                response = handle_custom_500_with_cors(request=request)
+                await response(scope, receive, send)
         duration: int = math.ceil((time.time() - start_time) * 1000)
 
-        response_content_type = response.headers.get(
-            "Content-Type", EMPTY_VALUE
-        )
-
-        try:
-            if "application/json" == response_content_type:
-                response_body = json.loads(response_body)
-            else:
-                response_body = EMPTY_VALUE
-        except json.decoder.JSONDecodeError:
-            response_body = response_body.decode()
+        if self.policy is not None and not self.policy.should_keep(
+            sampled=sampled,
+            status_code=response_status_code,
+            duration_ms=duration,
+            failed=exception_object is not None,
+        ):
+            return
 
+        request_headers: dict = dict(request.headers.items())
+        request_content_type = request_headers.get(
+            "content-type", EMPTY_VALUE
+        )
+        response_headers: dict = dict(
+            Headers(raw=response_raw_headers).items()
+        )
         request_size = int(request_headers.get("content-length", 0))
         response_size = int(response_headers.get("content-length", 0))
-        request_response_body_large = {
-            "sys-info": "Request/Response size is very large"
-        }
+        if exception_object is not None and not response_started:
+            response_log_body = http.HTTPStatus.INTERNAL_SERVER_ERROR.phrase
+        else:
+            response_log_body = response_body.value(response_size)
 
-        request_json_fields = RequestJsonLogSchema(
-            request_uri=str(request.url),
-            request_referer=request_headers.get("referer", EMPTY_VALUE),
-            request_protocol=await self.get_protocol(request),
-            request_method=request.method,
-            request_path=request.url.path,
-            request_host=f"{server[0]}:{server[1]}",
-            request_size=request_size,
-            request_content_type=request_content_type,
-            request_headers=request_headers,
-            request_body=request_body
-            if request_size <= 10000
-            else request_response_body_large,
-            request_direction="in",
-            remote_ip=request.client[0],
-            remote_port=request.client[1],
-            response_status_code=response.status_code,
-            response_size=response_size,
-            response_headers=response_headers,
-            response_body=response_body
-            if response_size <= 10000
-            else request_response_body_large,
-            duration=duration,
-        ).dict()
+        server: tuple = scope.get("server") or (
+            "localhost",
+            settings_app.PORT,
+        )
+        client: tuple = scope.get("client") or (EMPTY_VALUE, 0)
+        # Поля и их порядок описаны в RequestJsonLogSchema
+        request_json_fields = {
+            "request_uri": str(request.url),
+            "request_referer": request_headers.get("referer", EMPTY_VALUE),
+            "request_protocol": self.get_protocol(scope),
+            "request_method": request.method,
+            "request_path": request.url.path,
+            "request_host": f"{server[0]}:{server[1]}",
+            "request_size": request_size,
+            "request_content_type": request_content_type,
+            "request_headers": request_headers,
+            "request_body": request_body.value(request_size),
+            "request_direction": "in",
+            "remote_ip": str(client[0]),
+            "remote_port": str(client[1]),
+            "response_status_code": response_status_code,
+            "response_size": response_size,
+            "response_headers": response_headers,
+            "response_body": response_log_body,
+            "duration": duration,
+        }
         message = (
             f'{"Ошибка" if exception_object else "Ответ"} '
-            f"с кодом {response.status_code} "
+            f"с кодом {response_status_code} "
             f'на запрос {request.method} "{str(request.url)}", '
             f"за {duration} мс"
         )
@@ -221,12 +266,19 @@ class LoggingMiddleware:
             },
             exc_info=exception_object,
         )
-        return response
+        # Ответ уже начат - клиенту нельзя отправить 500, ошибка уходит
+        # выше, как и без журналирования
+        if exception_object is not None and response_started:
+            raise exception_object
 
 
 class OpenCensusFastAPIMiddleware:
     """
-    Middleware для реализации телеметрии для веб-запросов
+    Middleware для реализации телеметрии для веб-запросов.
+
+    С policy решение о выборке общее с LoggingMiddleware. Спаны запросов
+    вне выборки копятся в DeferredExporter и экспортируются, только если
+    сработало правило "сохранять всегда" (ошибка или медленный запрос)
     """
 
     def __init__(
@@ -237,11 +289,13 @@ class OpenCensusFastAPIMiddleware:
         sampler=None,
         exporter=None,
         propagator=None,
+        policy: Optional[RequestSamplingPolicy] = None,
     ) -> None:
         self.app = app
         self.excludelist_paths = excludelist_paths
         self.excludelist_hostnames = excludelist_hostnames
         self.sampler = sampler or samplers.AlwaysOnSampler()
+        self.policy = policy
         self.exporter = exporter or DefaultExporter()
         self.propagator = (
             propagator
@@ -256,13 +310,23 @@ class OpenCensusFastAPIMiddleware:
         ):
             return await call_next(request)
 
+        start_time = time.time()
+        sampled = True
+        sampler = self.sampler
+        exporter = self.exporter
+        if self.policy is not None:
+            sampled = self.policy.is_sampled(request.scope)
+            sampler = samplers.AlwaysOnSampler()
+            if not sampled:
+                exporter = DeferredExporter()
+
         try:
             span_context = self.propagator.from_headers(request.headers)
 
             fastapi_tracer = tracer_module.Tracer(
                 span_context=span_context,
-                sampler=self.sampler,
-                exporter=self.exporter,
+                sampler=sampler,
+                exporter=exporter,
                 propagator=self.propagator,
             )
         except Exception as ex:  # pragma: NO COVER
@@ -295,14 +359,26 @@ class OpenCensusFastAPIMiddleware:
         except Exception as ex:
             logger.error("Failed to trace request", exc_info=ex)
 
-        response = await call_next(request)
+        # Исключение приложения оставляет 500 - такой запрос сохраняется
+        status_code = http.HTTPStatus.INTERNAL_SERVER_ERROR.value
         try:
-            fastapi_tracer.add_attribute_to_current_span(
-                HTTP_STATUS_CODE,
-                response.status_code,
-            )
-        except Exception as ex:
-            logger.error("Failed to trace response", exc_info=ex)
+            response = await call_next(request)
+            status_code = response.status_code
         finally:
+            try:
+                fastapi_tracer.add_attribute_to_current_span(
+                    HTTP_STATUS_CODE,
+                    status_code,
+                )
+            except Exception as ex:
+                logger.error("Failed to trace response", exc_info=ex)
             fastapi_tracer.end_span()
-            return response
+            if isinstance(exporter, DeferredExporter) and (
+                self.policy.should_keep(
+                    sampled=sampled,
+                    status_code=status_code,
+                    duration_ms=(time.time() - start_time) * 1000,
+                )
+            ):
+                self.exporter.export(exporter.span_datas)
+        return response
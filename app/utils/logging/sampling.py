@@ -0,0 +1,71 @@
+import random
+from typing import Optional
+
+from starlette.types import Scope
+
+# Решение хранится в scope["state"], поэтому журналирование и трассировка
+# одного запроса всегда сэмплируются одинаково
+SCOPE_STATE_KEY = "telemetry_sampled"
+
+
+class RequestSamplingPolicy:
+    """
+    Общая политика сэмплирования журнала запросов и трассировки.
+
+    Решение принимается до обработки запроса: с вероятностью rate (или
+    значением из route_rates для самого длинного подходящего префикса
+    пути) запрос журналируется полностью, с телами запроса и ответа.
+    Для остальных тела не копируются, а запись и спаны сохраняются,
+    только если запрос завершился ошибкой или шёл дольше slow_request_ms.
+    """
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        route_rates: Optional[dict[str, float]] = None,
+        slow_request_ms: int = 1000,
+        keep_status_from: int = 500,
+    ):
+        self.rate = rate
+        self.route_rates = sorted(
+            (route_rates or {}).items(),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+        self.slow_request_ms = slow_request_ms
+        self.keep_status_from = keep_status_from
+
+    def rate_for(self, path: str) -> float:
+        for prefix, rate in self.route_rates:
+            if path.startswith(prefix):
+                return rate
+        return self.rate
+
+    def is_sampled(self, scope: Scope) -> bool:
+        state = scope.setdefault("state", {})
+        sampled = state.get(SCOPE_STATE_KEY)
+        if sampled is None:
+            # Путь как в request.url.path: с префиксом смонтированного
+            # приложения
+            path = scope.get("root_path", "") + scope.get("path", "")
+            rate = self.rate_for(path)
+            sampled = rate >= 1 or random.random() < rate
+            state[SCOPE_STATE_KEY] = sampled
+        return sampled
+
+    def should_keep(
+        self,
+        sampled: bool,
+        status_code: int,
+        duration_ms: float,
+        failed: bool = False,
+    ) -> bool:
+        """
+        Правила "сохранять всегда" для запросов вне выборки
+        """
+        return (
+            sampled
+            or failed
+            or status_code >= self.keep_status_from
+            or duration_ms >= self.slow_request_ms
+        )
@@ -7,7 +7,8 @@ from pydantic import Field
 
 class BaseJsonLogSchema(BaseModel):
     """
-    Схема основного тела лога в формате JSON
+    Схема основного тела лога в формате JSON. Описывает формат записи,
+    сами записи собирает словарём JSONLogFormatter
     """
 
     thread: Union[int, str]
@@ -30,7 +31,8 @@ class BaseJsonLogSchema(BaseModel):
 
 class RequestJsonLogSchema(BaseModel):
     """
-    Схема части запросов-ответов лога в формате JSON
+    Схема части запросов-ответов лога в формате JSON. Описывает формат,
+    поля собирает словарём LoggingMiddleware
     """
 
     request_uri: str
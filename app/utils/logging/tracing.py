@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import sys
+from abc import ABC
+from abc import abstractmethod
+from collections import deque
+from typing import Optional
+from typing import TextIO
+
+from opencensus.trace.base_exporter import Exporter
+from opencensus.trace.span_data import SpanData
+from opencensus.trace.span_data import format_legacy_trace_json
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+trace_spans_exported_total = Counter(
+    "trace_spans_exported_total",
+    "Спаны трассировки, переданные в sink",
+)
+trace_spans_dropped_total = Counter(
+    "trace_spans_dropped_total",
+    "Отброшенные спаны трассировки",
+    ["reason"],
+)
+
+
+class SpanSink(ABC):
+    """
+    Назначение экспорта спанов для BatchSpanExporter
+    """
+
+    @abstractmethod
+    async def write(self, span_datas: list[SpanData]) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class StreamSpanSink(SpanSink):
+    """
+    Спаны JSON-строками в stdout или файл. Запись идёт в отдельном
+    потоке, чтобы медленный вывод не блокировал event loop
+    """
+
+    def __init__(
+        self, filename: Optional[str] = None, stream: Optional[TextIO] = None
+    ):
+        if filename:
+            self.stream = open(filename, "a", encoding="utf-8")
+            self._owns_stream = True
+        else:
+            self.stream = stream or sys.stdout
+            self._owns_stream = False
+
+    async def write(self, span_datas: list[SpanData]) -> None:
+        lines = "".join(
+            json.dumps(format_legacy_trace_json([span_data]), default=str)
+            + "\n"
+            for span_data in span_datas
+        )
+        await asyncio.to_thread(self._write, lines)
+
+    def _write(self, lines: str) -> None:
+        self.stream.write(lines)
+        self.stream.flush()
+
+    async def close(self) -> None:
+        if self._owns_stream:
+            self.stream.close()
+
+
+class MemorySpanSink(SpanSink):
+    """
+    Заглушка коллектора для проверок: хранит полученные спаны
+    """
+
+    def __init__(self):
+        self.span_datas: list[SpanData] = []
+
+    async def write(self, span_datas: list[SpanData]) -> None:
+        self.span_datas.extend(span_datas)
+
+
+class BatchSpanExporter(Exporter):
+    """
+    Экспорт спанов вне пути запроса.
+
+    export только кладёт спаны в буфер на buffer_size штук, фоновая задача
+    отправляет их в sink пачками по batch_size или раз в flush_interval
+    секунд. При полном буфере новые спаны отбрасываются и учитываются в
+    trace_spans_dropped_total. Вызывается из event loop приложения.
+    """
+
+    def __init__(
+        self,
+        sink: Optional[SpanSink] = None,
+        buffer_size: int = 10000,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+    ):
+        self.sink = sink or StreamSpanSink()
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: deque[SpanData] = deque()
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+    def emit(self, span_datas: list[SpanData]) -> None:
+        self.export(span_datas)
+
+    def export(self, span_datas: list[SpanData]) -> None:
+        free = self.buffer_size - len(self._buffer)
+        if len(span_datas) > free:
+            trace_spans_dropped_total.labels(reason="overflow").inc(
+                len(span_datas) - max(free, 0)
+            )
+            span_datas = span_datas[: max(free, 0)]
+        self._buffer.extend(span_datas)
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """
+        Спаны из буфера отправляются до остановки
+        """
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        await self.sink.close()
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if not self._closing and len(self._buffer) < self.batch_size:
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), timeout=self.flush_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = [
+                self._buffer.popleft()
+                for _ in range(min(len(self._buffer), self.batch_size))
+            ]
+            if batch:
+                await self._write(batch)
+            elif self._closing:
+                return
+
+    async def _write(self, batch: list[SpanData]) -> None:
+        try:
+            await self.sink.write(batch)
+        except Exception:
+            logger.exception("span export failed")
+            trace_spans_dropped_total.labels(reason="sink_error").inc(
+                len(batch)
+            )
+        else:
+            trace_spans_exported_total.inc(len(batch))
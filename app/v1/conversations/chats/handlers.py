@@ -1,14 +1,31 @@
 from typing import Any
+from typing import Callable
+from typing import Union
 from uuid import UUID
 
 from fastapi import APIRouter
 from fastapi import Depends
+from fastapi import Query
+from pyfa_converter import PyFaDepends
 
+from app.db.models import Conversation
+from app.services.redis.queue.client import RedisSocketQueue
+from app.services.redis.queue.dependencies import (
+    RedisSocketQueueDependencyMarker,
+)
+from app.socket.rooms import SOCKET_NAMESPACE
+from app.socket.rooms import user_room
+from app.utils.encoders import jsonable_encoder
 from app.utils.decorators import standardize_response
 from app.v1.conversations.chats.dependencies import ChatDependencyMarker
+from app.v1.conversations.chats.models import ChatCreatedSocketModel
 from app.v1.conversations.chats.models import CreateChatModel
 from app.v1.conversations.chats.models import GetChatDTO
+from app.v1.conversations.chats.models import QueryChatModel
+from app.v1.conversations.chats.models import QueryPublicChatModel
 from app.v1.conversations.chats.repo import ChatRepository
+from app.v1.schemas.pagination import CursorPage
+from app.v1.schemas.pagination import encode_cursor
 from app.v1.schemas.responses import BaseResponse
 from app.v1.security.auth import GetCurrentUser
 from app.v1.statuses.enums import StatusEnum
@@ -17,22 +34,63 @@ from app.v1.users.schemas import GetCurrentUserModel
 chat_router = APIRouter()
 
 
+def _build_chats_page(
+    conversations: list[Conversation],
+    limit: int,
+    cursor_key: Callable[[Conversation], tuple[Any, ...]],
+) -> CursorPage[GetChatDTO]:
+    """
+    Сборка страницы из limit + 1 записей: лишняя запись означает,
+    что есть следующая страница
+    """
+    has_more = len(conversations) > limit
+    conversations = conversations[:limit]
+
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor(*cursor_key(conversations[-1]))
+
+    return CursorPage[GetChatDTO](
+        items=[GetChatDTO.from_orm(element) for element in conversations],
+        next_cursor=next_cursor,
+    )
+
+
 @chat_router.get(
     "/chats",
-    response_model=BaseResponse[list[GetChatDTO]],
+    response_model=BaseResponse[
+        Union[CursorPage[GetChatDTO], list[GetChatDTO]]
+    ],
     summary="Получить все чаты пользователя",
 )
 @standardize_response(status_code=200)
 async def get_chats(
+    filters: QueryChatModel = PyFaDepends(QueryChatModel, _type=Query),
     chat_repo: ChatRepository = Depends(ChatDependencyMarker),
     current_user: GetCurrentUserModel = Depends(
         GetCurrentUser(status=[StatusEnum.ACTIVE])
     ),
 ):
     """
-    Получить активные чаты пользователя
+    Получить активные чаты пользователя, начиная с последней активности.
+    С limit или before ответ разбивается на страницы по курсору
     """
-    return await chat_repo.get_all_from_user_uuid(uuid=current_user.uuid)
+    if not filters.is_cursor:
+        return await chat_repo.get_all_from_user_uuid(uuid=current_user.uuid)
+
+    conversations = await chat_repo.get_all_from_user_uuid(
+        uuid=current_user.uuid,
+        limit=filters.page_limit + 1,
+        before=filters.before_key,
+    )
+    return _build_chats_page(
+        conversations=conversations,
+        limit=filters.page_limit,
+        cursor_key=lambda element: (
+            element.inbox.last_message_at.isoformat(),
+            element.uuid,
+        ),
+    )
 
 
 @chat_router.post(
@@ -44,6 +102,7 @@ async def get_chats(
 async def create_public_chat(
     data: CreateChatModel,
     chat_repo: ChatRepository = Depends(ChatDependencyMarker),
+    redis: RedisSocketQueue = Depends(RedisSocketQueueDependencyMarker),
     current_user: GetCurrentUserModel = Depends(
         GetCurrentUser(status=[StatusEnum.ACTIVE])
     ),
@@ -57,12 +116,62 @@ async def create_public_chat(
         chat=data.chat,
         companion=data.companion,
     )
+
+    # Открытые сокеты участников ещё не в комнате нового чата: клиент
+    # получает событие в комнату пользователя и подписывается сам
+    members = [current_user.uuid]
+    if data.companion:
+        members.append(data.companion.uuid)
+    data_for_socket = ChatCreatedSocketModel.from_orm(conversation)
+    for member in members:
+        await redis.emit(
+            "newChatResponse",
+            jsonable_encoder(data_for_socket.dict()),
+            namespace=SOCKET_NAMESPACE,
+            room=user_room(member),
+        )
+
     return await chat_repo.get_one_from_conversation_uuid(
         user_uuid=current_user.uuid,
         chat_uuid=conversation.uuid
     )
 
 
+@chat_router.get(
+    "/chats/public",
+    response_model=BaseResponse[CursorPage[GetChatDTO]],
+    summary="Поиск публичных чатов",
+)
+@standardize_response(status_code=200)
+async def get_public_chats(
+    filters: QueryPublicChatModel = PyFaDepends(
+        QueryPublicChatModel, _type=Query
+    ),
+    chat_repo: ChatRepository = Depends(ChatDependencyMarker),
+    current_user: GetCurrentUserModel = Depends(
+        GetCurrentUser(status=[StatusEnum.ACTIVE])
+    ),
+):
+    """
+    Получить публичные чаты, начиная с последней активности.
+    Поле inbox заполнено только для чатов, где пользователь уже участник
+    """
+    conversations = await chat_repo.get_public_page(
+        user_uuid=current_user.uuid,
+        limit=filters.limit + 1,
+        title=filters.title,
+        before=filters.before_key,
+    )
+    return _build_chats_page(
+        conversations=conversations,
+        limit=filters.limit,
+        cursor_key=lambda element: (
+            element.last_message_at.isoformat(),
+            element.uuid,
+        ),
+    )
+
+
 @chat_router.get(
     "/chats/{uuid}",
     response_model=BaseResponse[GetChatDTO],
@@ -83,3 +192,23 @@ async def create_public_chat(
         user_uuid=current_user.uuid,
         chat_uuid=uuid
     )
+
+
+@chat_router.post(
+    "/chats/{uuid}/read",
+    response_model=BaseResponse,
+    summary="Отметить чат прочитанным",
+)
+@standardize_response(status_code=200)
+async def mark_chat_read(
+    uuid: UUID,
+    chat_repo: ChatRepository = Depends(ChatDependencyMarker),
+    current_user: GetCurrentUserModel = Depends(
+        GetCurrentUser(status=[StatusEnum.ACTIVE])
+    ),
+):
+    """
+    Сбросить счётчик непрочитанных сообщений чата
+    """
+    await chat_repo.mark_read(user_uuid=current_user.uuid, chat_uuid=uuid)
+    return None
@@ -4,10 +4,13 @@ from typing import Any
 from typing import Optional
 from uuid import UUID
 
+from pydantic import Field
 from pydantic import root_validator
+from pydantic import validator
 
 from app.v1.schemas.base import BaseModelORM
 from app.v1.schemas.base import BaseTimeStampMixin
+from app.v1.schemas.pagination import decode_cursor
 from app.v1.statuses.schemas import StatusGetMixinV3
 from app.v1.users.schemas import GetUserModel
 
@@ -59,6 +62,13 @@ class ChatItemDTO(BaseTimeStampMixin, StatusGetMixinV3):
     # conversation: list[Any]
 
 
+class ChatInboxDTO(BaseModelORM):
+    last_message_id: Optional[UUID] = None
+    last_message_preview: Optional[str] = None
+    last_message_at: datetime.datetime
+    unread_count: int = 0
+
+
 class GetChatDTO(BaseTimeStampMixin):
     uuid: UUID
     type_id: int
@@ -66,3 +76,64 @@ class GetChatDTO(BaseTimeStampMixin):
     chat_id: Optional[UUID]
     chat_type: ChatType
     chat: Optional[ChatItemDTO]
+    inbox: Optional[ChatInboxDTO] = None
+    last_message_at: Optional[datetime.datetime] = None
+
+
+class ChatCreatedSocketModel(BaseModelORM):
+    uuid: UUID
+    type_id: int
+    chat_id: Optional[UUID] = None
+
+
+class QueryChatModel(BaseModelORM):
+    limit: Optional[int] = Field(
+        None,
+        ge=1,
+        le=100,
+        description="Без limit и before возвращается весь список чатов",
+    )
+    before: Optional[str] = Field(
+        None, description="Курсор для загрузки следующей страницы"
+    )
+
+    @validator("before")
+    def validate_cursor(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None:
+            cls.decode_chat_cursor(value)
+        return value
+
+    @staticmethod
+    def decode_chat_cursor(cursor: str) -> tuple[datetime.datetime, UUID]:
+        values = decode_cursor(cursor)
+        if len(values) != 2:
+            raise ValueError("Некорректный курсор пагинации")
+        try:
+            last_message_at = datetime.datetime.fromisoformat(values[0])
+            chat_uuid = UUID(values[1])
+        except (AttributeError, TypeError, ValueError) as exc:
+            raise ValueError("Некорректный курсор пагинации") from exc
+        if last_message_at.tzinfo is None:
+            raise ValueError("Некорректный курсор пагинации")
+        return last_message_at, chat_uuid
+
+    @property
+    def is_cursor(self) -> bool:
+        return bool(self.limit or self.before)
+
+    @property
+    def page_limit(self) -> int:
+        return self.limit or 20
+
+    @property
+    def before_key(self) -> Optional[tuple[datetime.datetime, UUID]]:
+        if self.before:
+            return self.decode_chat_cursor(self.before)
+        return None
+
+
+class QueryPublicChatModel(QueryChatModel):
+    title: Optional[str] = Field(
+        None, min_length=1, description="Начало названия чата"
+    )
+    limit: int = Field(20, ge=1, le=100)
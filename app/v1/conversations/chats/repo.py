@@ -1,11 +1,21 @@
+import datetime
+import re
+from typing import Optional
+from typing import Sequence
 from uuid import UUID
 
+from sqlalchemy import and_
+from sqlalchemy import any_
+from sqlalchemy import desc
+from sqlalchemy import exists
 from sqlalchemy import func
-from sqlalchemy import literal_column
+from sqlalchemy import literal
 from sqlalchemy import or_
 from sqlalchemy import select
+from sqlalchemy import tuple_
+from sqlalchemy import update
 from sqlalchemy.dialects import postgresql
-from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import contains_eager
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import noload
@@ -17,9 +27,8 @@ from app.db.decorators import orm_error_handler
 from app.db.models import Chat
 from app.db.models import ChatType
 from app.db.models import Conversation
+from app.db.models import ConversationInbox
 from app.db.models import ConversationUser
-from app.db.models import Document
-from app.db.models import Role
 from app.db.models import User
 from app.v1.conversations.chats.models import ChatDTO
 from app.v1.conversations.chats.models import ChatTypeEnum
@@ -34,61 +43,25 @@ class ChatRepository:
         self.base = BaseCRUD(db_session=db_session, model=self.model)
 
     @orm_error_handler
-    async def get_all_from_user_uuid(self, uuid: UUID) -> list[Conversation]:
+    async def get_all_from_user_uuid(
+        self,
+        uuid: UUID,
+        limit: Optional[int] = None,
+        before: Optional[tuple[datetime.datetime, UUID]] = None,
+    ) -> list[Conversation]:
+        """
+        Чаты пользователя по убыванию активности. Keyset по
+        (last_message_at, conversation_id) строки инбокса
+        """
         async with self.base.transaction_v2() as transaction:
-            UserConversationAlias = aliased(ConversationUser, name="uc2")
-            UserAlias = aliased(User, name="u1")
-
-            avatar_expression = (
-                select(Document)
-                .filter(Document.uuid == UserAlias.avatar_id)
-                .correlate(UserAlias)
-            ).alias("meta_avatar")
-
-            jsonb_meta_avatar = select(
-                func.to_jsonb(literal_column("meta_avatar"))
-            ).select_from(avatar_expression)
-
-            role_expression = (
-                select(Role)
-                .filter(Role.id == UserAlias.role_id)
-                .correlate(UserAlias)
-            ).alias("meta_role")
-
-            jsonb_meta_role = select(
-                func.to_jsonb(literal_column("meta_role"))
-            ).select_from(role_expression)
-
-
-            companion_expression = (
-                select(
-                    UserAlias,
-                    jsonb_meta_avatar.label("avatar"),
-                    jsonb_meta_role.label("role"),
-                )
-                .join(
-                    UserConversationAlias,
-                    UserConversationAlias.user_id == UserAlias.uuid,
-                )
-                .filter(
-                    UserConversationAlias.conversation_id == Conversation.uuid,
-                    Conversation.type_id == 1,
-                    UserAlias.uuid != uuid,
-                )
-                .correlate(Conversation)
-            ).alias("meta_json")
-
-            jsonb_meta_companion = select(
-                func.to_jsonb(literal_column("meta_json"))
-            ).select_from(companion_expression)
-
             stmt = (
                 select(Conversation)
                 .join(
-                    target=ConversationUser,
-                    onclause=ConversationUser.conversation_id
-                             == Conversation.uuid,
-                    isouter=True,
+                    target=ConversationInbox,
+                    onclause=and_(
+                        ConversationInbox.conversation_id == Conversation.uuid,
+                        ConversationInbox.user_id == uuid,
+                    ),
                 )
                 .join(
                     target=Chat,
@@ -101,25 +74,35 @@ class ChatRepository:
                     isouter=True,
                 )
                 .options(
-                    with_expression(
-                        key=Conversation.companion,
-                        expression=jsonb_meta_companion.scalar_subquery(),
-                    ),
                     contains_eager(Conversation.chat),
                     contains_eager(Conversation.chat_type),
+                    contains_eager(Conversation.inbox),
                 )
                 .options(noload("*"))
-                .filter(
-                    or_(
-                        ConversationUser.user_id == uuid,
-                        Conversation.type_id == 3,
-                    )
+                .order_by(
+                    desc(ConversationInbox.last_message_at),
+                    desc(ConversationInbox.conversation_id),
                 )
-                .group_by(Conversation.uuid, Chat.uuid, ChatType.id)
             )
+            if before:
+                stmt = stmt.filter(
+                    tuple_(
+                        ConversationInbox.last_message_at,
+                        ConversationInbox.conversation_id,
+                    )
+                    < before
+                )
+            if limit:
+                stmt = stmt.limit(limit)
 
             cursor = await transaction.execute(stmt)
-            return cursor.scalars().all()
+            conversations = cursor.scalars().all()
+            await self._attach_companions(
+                conversations=conversations,
+                user_uuid=uuid,
+                transaction=transaction,
+            )
+            return conversations
 
     @orm_error_handler
     async def get_one_from_conversation_uuid(
@@ -128,51 +111,6 @@ class ChatRepository:
         chat_uuid: UUID
     ) -> Conversation:
         async with self.base.transaction_v2() as transaction:
-            UserConversationAlias = aliased(ConversationUser, name="uc2")
-            UserAlias = aliased(User, name="u1")
-
-            avatar_expression = (
-                select(Document)
-                .filter(Document.uuid == UserAlias.avatar_id)
-                .correlate(UserAlias)
-            ).alias("meta_avatar")
-
-            jsonb_meta_avatar = select(
-                func.to_jsonb(literal_column("meta_avatar"))
-            ).select_from(avatar_expression)
-
-            role_expression = (
-                select(Role)
-                .filter(Role.id == UserAlias.role_id)
-                .correlate(UserAlias)
-            ).alias("meta_role")
-
-            jsonb_meta_role = select(
-                func.to_jsonb(literal_column("meta_role"))
-            ).select_from(role_expression)
-
-            companion_expression = (
-                select(
-                    UserAlias,
-                    jsonb_meta_avatar.label("avatar"),
-                    jsonb_meta_role.label("role")
-                )
-                .join(
-                    UserConversationAlias,
-                    UserConversationAlias.user_id == UserAlias.uuid,
-                )
-                .filter(
-                    UserConversationAlias.conversation_id == Conversation.uuid,
-                    Conversation.type_id == 1,
-                    UserAlias.uuid != user_uuid,
-                )
-                .correlate(Conversation)
-            ).alias("meta_json")
-
-            jsonb_meta_companion = select(
-                func.to_jsonb(literal_column("meta_json"))
-            ).select_from(companion_expression)
-
             stmt = (
                 select(Conversation)
                 .join(
@@ -190,23 +128,140 @@ class ChatRepository:
                     onclause=ChatType.id == Conversation.type_id,
                     isouter=True,
                 )
-                .options(
-                    with_expression(
-                        key=Conversation.companion,
-                        expression=jsonb_meta_companion.scalar_subquery(),
+                .join(
+                    target=ConversationInbox,
+                    onclause=and_(
+                        ConversationInbox.conversation_id == Conversation.uuid,
+                        ConversationInbox.user_id == user_uuid,
                     ),
+                    isouter=True,
+                )
+                .options(
                     contains_eager(Conversation.chat),
                     contains_eager(Conversation.chat_type),
+                    contains_eager(Conversation.inbox),
                 )
                 .options(noload("*"))
                 .filter(
                     ConversationUser.user_id == user_uuid,
                 )
                 .filter(Conversation.uuid == chat_uuid)
-                .group_by(Conversation.uuid, Chat.uuid, ChatType.id)
             )
             cursor = await transaction.execute(stmt)
-            return cursor.scalar_one()
+            conversation = cursor.scalar_one()
+            await self._attach_companions(
+                conversations=[conversation],
+                user_uuid=user_uuid,
+                transaction=transaction,
+            )
+            return conversation
+
+    @orm_error_handler
+    async def get_public_page(
+        self,
+        user_uuid: UUID,
+        limit: int = 20,
+        title: Optional[str] = None,
+        before: Optional[tuple[datetime.datetime, UUID]] = None,
+    ) -> list[Conversation]:
+        """
+        Публичные чаты по убыванию активности (keyset по last_message_at, uuid)
+        с необязательным фильтром по началу названия
+        """
+        stmt = (
+            select(Conversation)
+            .join(target=Chat, onclause=Chat.uuid == Conversation.chat_id)
+            .join(
+                target=ChatType,
+                onclause=ChatType.id == Conversation.type_id,
+                isouter=True,
+            )
+            .join(
+                target=ConversationInbox,
+                onclause=and_(
+                    ConversationInbox.conversation_id == Conversation.uuid,
+                    ConversationInbox.user_id == user_uuid,
+                ),
+                isouter=True,
+            )
+            .options(
+                contains_eager(Conversation.chat),
+                contains_eager(Conversation.chat_type),
+                contains_eager(Conversation.inbox),
+            )
+            .options(noload("*"))
+            .filter(Conversation.type_id == 3)
+            .order_by(
+                desc(Conversation.last_message_at),
+                desc(Conversation.uuid),
+            )
+            .limit(limit)
+        )
+
+        if title:
+            # Шаблон собирается целиком, чтобы планировщик использовал
+            # ix_chats_title_lower для префиксного LIKE
+            pattern = re.sub(r"([\\%_])", r"\\\1", title.lower())
+            stmt = stmt.filter(
+                func.lower(Chat.title).like(f"{pattern}%", escape="\\")
+            )
+
+        if before:
+            stmt = stmt.filter(
+                tuple_(Conversation.last_message_at, Conversation.uuid)
+                < before
+            )
+
+        async with self.base.transaction_v2() as transaction:
+            cursor = await transaction.execute(stmt)
+            return cursor.scalars().all()
+
+    async def _attach_companions(
+        self,
+        conversations: Sequence[Conversation],
+        user_uuid: UUID,
+        transaction: AsyncSession,
+    ) -> None:
+        """
+        Собеседники личных чатов загружаются одним запросом по всем
+        conversation_id (аватар и роль через join) и расставляются в Python
+        """
+        private_ids = [
+            conversation.uuid
+            for conversation in conversations
+            if conversation.type_id == 1
+        ]
+        if not private_ids:
+            return
+
+        stmt = (
+            select(ConversationUser.conversation_id, User)
+            .join(User, User.uuid == ConversationUser.user_id)
+            .filter(
+                ConversationUser.conversation_id
+                == any_(
+                    literal(
+                        private_ids,
+                        type_=postgresql.ARRAY(
+                            ConversationUser.conversation_id.type
+                        ),
+                    )
+                ),
+                ConversationUser.user_id != user_uuid,
+            )
+            .options(
+                with_expression(User.is_me, literal(False)),
+                joinedload(User.avatar),
+                joinedload(User.role),
+            )
+        )
+        cursor = await transaction.execute(stmt)
+        companions = {
+            conversation_id: user for conversation_id, user in cursor.all()
+        }
+
+        for conversation in conversations:
+            conversation.companion = companions.get(conversation.uuid)
 
     @orm_error_handler
     async def get_private_chat_from_users(self, user_1: UUID, user_2: UUID) -> Conversation:
@@ -262,6 +317,12 @@ class ChatRepository:
                     user_id=user_id,
                 )
                 transaction.add(user_conversation)
+                transaction.add(
+                    ConversationInbox(
+                        conversation_id=conversation.uuid,
+                        user_id=user_id,
+                    )
+                )
 
             if type_ == ChatTypeEnum.PRIVATE:
                 created_chat = await self.get_private_chat_from_users(
@@ -287,6 +348,61 @@ class ChatRepository:
                         user_id=companion.uuid,
                     )
                     transaction.add(companion_conversation)
+                    transaction.add_all(
+                        [
+                            ConversationInbox(
+                                conversation_id=conversation.uuid,
+                                user_id=member,
+                            )
+                            for member in (user_id, companion.uuid)
+                        ]
+                    )
 
             await transaction.commit()
             return conversation
+
+    @orm_error_handler
+    async def get_conversation_ids(self, user_uuid: UUID) -> list[UUID]:
+        async with self.base.transaction_v2() as transaction:
+            stmt = select(ConversationUser.conversation_id).filter(
+                ConversationUser.user_id == user_uuid
+            )
+            cursor = await transaction.execute(stmt)
+            return cursor.scalars().all()
+
+    @orm_error_handler
+    async def can_subscribe(self, user_uuid: UUID, chat_uuid: UUID) -> bool:
+        """
+        Подписка на события чата доступна участнику и любому пользователю
+        публичного чата
+        """
+        membership = exists().where(
+            ConversationUser.conversation_id == Conversation.uuid,
+            ConversationUser.user_id == user_uuid,
+        )
+        async with self.base.transaction_v2() as transaction:
+            stmt = select(
+                exists().where(
+                    Conversation.uuid == chat_uuid,
+                    or_(Conversation.type_id == 3, membership),
+                )
+            )
+            cursor = await transaction.execute(stmt)
+            return cursor.scalar_one()
+
+    @orm_error_handler
+    async def mark_read(self, user_uuid: UUID, chat_uuid: UUID) -> None:
+        async with self.base.transaction_v2() as transaction:
+            stmt = (
+                update(ConversationInbox)
+                .where(
+                    ConversationInbox.user_id == user_uuid,
+                    ConversationInbox.conversation_id == chat_uuid,
+                )
+                .values(
+                    unread_count=0,
+                    last_read_message_id=ConversationInbox.last_message_id,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await transaction.execute(stmt)
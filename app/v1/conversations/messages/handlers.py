@@ -1,22 +1,33 @@
+from typing import Union
 from uuid import UUID
+
 from fastapi import APIRouter
 from fastapi import Depends
+from fastapi import HTTPException
 from fastapi import Query
 from fastapi import UploadFile
 from pyfa_converter import BodyDepends
 from pyfa_converter import PyFaDepends
+from starlette import status as starlette_status
+from starlette.responses import StreamingResponse
 
+from app.i18n.tr import get_locale
 from app.utils.decorators import standardize_response
-from app.v1.conversations.messages.dependencies import MessageDependencyMarker
+from app.v1.conversations.chats.dependencies import ChatDependencyMarker
+from app.v1.conversations.chats.repo import ChatRepository
 from app.v1.conversations.messages.dependencies import (
     MessageServiceDependencyMarker,
 )
+from app.v1.conversations.messages.schemas import MessageBatchResultModel
+from app.v1.conversations.messages.schemas import MessageBatchSendModel
 from app.v1.conversations.messages.schemas import MessageDeleteModel
 from app.v1.conversations.messages.schemas import MessageGetModel
 from app.v1.conversations.messages.schemas import MessageSendModel
+from app.v1.conversations.messages.schemas import QueryMessageExportModel
 from app.v1.conversations.messages.schemas import QueryMessageModel
 from app.v1.conversations.messages.schemas import UpdateMessageModel
 from app.v1.conversations.messages.services import MessageService
+from app.v1.schemas.pagination import CursorPage
 from app.v1.schemas.responses import BaseResponse
 from app.v1.security.auth import GetCurrentUser
 from app.v1.statuses.enums import StatusEnum
@@ -27,22 +38,34 @@ message_router = APIRouter()
 
 @message_router.get(
     "/chats/{chat_id}/messages",
-    response_model=BaseResponse[list[MessageGetModel]],
+    response_model=BaseResponse[
+        Union[CursorPage[MessageGetModel], list[MessageGetModel]]
+    ],
     summary="Получить все сообщения чата",
 )
 @standardize_response(status_code=200)
 async def get_messages_from_chat(
     chat_id: UUID,
     filters: QueryMessageModel = PyFaDepends(QueryMessageModel, _type=Query),
-    chat_repo: MessageService = Depends(MessageDependencyMarker),
+    chat_service: MessageService = Depends(MessageServiceDependencyMarker),
     current_user: GetCurrentUserModel = Depends(
         dependency=GetCurrentUser(status=[StatusEnum.ACTIVE])
     ),
 ):
     """
-    Получить активные чаты пользователя
+    Получить сообщения чата.
+    При pagination=cursor, before или after возвращается страница с курсорами
+    next_cursor (более старые сообщения) и prev_cursor (более новые).
     """
-    return await chat_repo.get_all(
+    if filters.is_cursor:
+        return await chat_service.get_page(
+            user_id=current_user.uuid,
+            chat_id=chat_id,
+            limit=filters.limit,
+            before=filters.before_uuid,
+            after=filters.after_uuid,
+        )
+    return await chat_service.get_all(
         user_id=current_user.uuid,
         chat_id=chat_id,
         limit=filters.limit,
@@ -50,25 +73,82 @@ async def get_messages_from_chat(
     )
 
 
+@message_router.get(
+    "/chats/{chat_id}/messages/export",
+    response_class=StreamingResponse,
+    summary="Выгрузить историю чата в NDJSON",
+)
+async def export_messages_from_chat(
+    chat_id: UUID,
+    filters: QueryMessageExportModel = PyFaDepends(
+        QueryMessageExportModel, _type=Query
+    ),
+    chat_service: MessageService = Depends(MessageServiceDependencyMarker),
+    chat_repo: ChatRepository = Depends(ChatDependencyMarker),
+    current_user: GetCurrentUserModel = Depends(
+        dependency=GetCurrentUser(status=[StatusEnum.ACTIVE])
+    ),
+):
+    """
+    Выгрузить всю историю чата (application/x-ndjson), по сообщению на
+    строку в порядке создания. Ответ отдаётся потоком с серверного
+    курсора, поэтому подходит для чатов любого размера.
+    Объявлен до /chats/{chat_id}/messages/{message_id}.
+    """
+    if not await chat_repo.can_subscribe(
+        user_uuid=current_user.uuid, chat_uuid=chat_id
+    ):
+        raise HTTPException(
+            status_code=starlette_status.HTTP_403_FORBIDDEN,
+            detail="Нет доступа к чату",
+        )
+
+    return StreamingResponse(
+        chat_service.export(
+            chat_id=chat_id,
+            date_from=filters.date_from,
+            date_to=filters.date_to,
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
 @message_router.get(
     "/chats/{chat_id}/messages/{message_id}",
-    response_model=BaseResponse[list[MessageGetModel]],
+    response_model=BaseResponse[
+        Union[CursorPage[MessageGetModel], list[MessageGetModel]]
+    ],
     summary="Получить все сообщения треда",
 )
 @standardize_response(status_code=200)
 async def get_messages_from_chat_and_message(
     chat_id: UUID,
     message_id: UUID,
-    chat_service: MessageService = Depends(MessageDependencyMarker),
+    filters: QueryMessageModel = PyFaDepends(QueryMessageModel, _type=Query),
+    chat_service: MessageService = Depends(MessageServiceDependencyMarker),
     current_user: GetCurrentUserModel = Depends(
         dependency=GetCurrentUser(status=[StatusEnum.ACTIVE])
     ),
 ):
     """
-    Получить активные чаты пользователя
+    Получить сообщения треда.
+    Поддерживает те же режимы пагинации, что и список сообщений чата.
     """
+    if filters.is_cursor:
+        return await chat_service.get_page(
+            user_id=current_user.uuid,
+            chat_id=chat_id,
+            message_id=message_id,
+            limit=filters.limit,
+            before=filters.before_uuid,
+            after=filters.after_uuid,
+        )
     return await chat_service.get_all(
-        user_id=current_user.uuid, chat_id=chat_id, message_id=message_id
+        user_id=current_user.uuid,
+        chat_id=chat_id,
+        message_id=message_id,
+        limit=filters.limit,
+        offset=filters.offset,
     )
 
 
@@ -99,6 +179,34 @@ async def send_message_to_chat(
     return None
 
 
+@message_router.post(
+    "/chats/{chat_id}/messages:batch",
+    response_model=BaseResponse[MessageBatchResultModel],
+    summary="Отправить несколько сообщений в чат",
+)
+@standardize_response(status_code=200)
+async def send_messages_batch_to_chat(
+    chat_id: UUID,
+    data: MessageBatchSendModel,
+    locale: str = Depends(get_locale),
+    chat_service: MessageService = Depends(MessageServiceDependencyMarker),
+    current_user: GetCurrentUserModel = Depends(
+        dependency=GetCurrentUser(status=[StatusEnum.ACTIVE])
+    ),
+):
+    """
+    Отправить пакет сообщений одной транзакцией.
+    Результат возвращается по каждому элементу: uuid созданного сообщения
+    или ошибки проверки, ошибочные элементы пропускаются.
+    """
+    return await chat_service.create_many(
+        conversation_id=chat_id,
+        author=current_user,
+        messages=data.messages,
+        locale=locale,
+    )
+
+
 @message_router.delete(
     "/chats/{chat_id}/messages/{message_id}",
     response_model=BaseResponse[MessageDeleteModel],
@@ -1,30 +1,66 @@
+import datetime
+from typing import AsyncIterator
 from typing import List
 from typing import Optional
 from typing import Sequence
-from typing import Type
 from uuid import UUID
 
 from sqlalchemy import and_
+from sqlalchemy import asc
+from sqlalchemy import DateTime
 from sqlalchemy import case
+from sqlalchemy import delete
 from sqlalchemy import desc
 from sqlalchemy import func
+from sqlalchemy import literal
+from sqlalchemy import or_
 from sqlalchemy import select
+from sqlalchemy import union
+from sqlalchemy import update
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import aliased
+from sqlalchemy.orm import contains_eager
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import subqueryload
-from sqlalchemy.orm import with_expression
+from sqlalchemy.orm.attributes import set_committed_value
+from uuid_extensions import uuid7
 
 from app.db.crud.base import BaseCRUD
 from app.db.decorators import orm_error_handler
+from app.db.models import Conversation
+from app.db.models import ConversationInbox
 from app.db.models import ConversationUser
 from app.db.models import Document
 from app.db.models import Message
 from app.db.models import MessageDocument
+from app.db.models import SocketOutbox
 from app.db.models import User
+from app.db.types.date_time import MOSCOW_TIMEZONE
 from app.dto.documents import SystemFileDTO
+from app.socket.outbox import SocketEvent
+from app.socket.outbox import SocketEventsFactory
+from app.v1.conversations.messages.schemas import MessageSendModel
+
+INBOX_PREVIEW_LENGTH = 255
+EXPORT_CHUNK_SIZE = 1000
+
+
+def _literal_rows(model, data: list[dict]) -> list[dict]:
+    """
+    Значения вставки как анонимные параметры: несколько INSERT в CTE
+    одного запроса не конфликтуют по именам колонок.
+    """
+    columns = model.__table__.c
+    return [
+        {
+            key: literal(value, type_=columns[key].type)
+            for key, value in row.items()
+        }
+        for row in data
+    ]
 
 
 class MessageRepository:
@@ -33,14 +69,11 @@ class MessageRepository:
         self.model = Message
 
         self.base = BaseCRUD(db_session=db_session, model=self.model)
-        self.base_conversation = BaseCRUD(
-            db_session=db_session, model=ConversationUser
-        )
 
     def create_many_files_messages_stmt(self, data: list[dict[str, str]]):
         return (
             insert(MessageDocument)
-            .values(data)
+            .values(_literal_rows(MessageDocument, data))
             .on_conflict_do_nothing()
             .returning(MessageDocument.uuid)
         )
@@ -48,9 +81,9 @@ class MessageRepository:
     def create_many_files_stmt(self, data: list[dict[str, UUID]]):
         return (
             insert(Document)
-            .values(data)
+            .values(_literal_rows(Document, data))
             .on_conflict_do_nothing()
-            .returning(Document.uuid)
+            .returning(Document)
         )
 
     @orm_error_handler
@@ -61,59 +94,253 @@ class MessageRepository:
         text: str,
         files: list[UUID],
         reply_uuid: Optional[UUID] = None,
+        socket_events: Optional[SocketEventsFactory] = None,
     ) -> Message:
-        async with self.base.transaction_v2() as transaction:
-            if not await self.base_conversation.exists(
-                ConversationUser.user_id == author_id,
-                ConversationUser.conversation_id == conversation_id,
-                transaction=transaction,
-            ):
-                user_conversation = ConversationUser(
-                    conversation_id=conversation_id,
-                    user_id=author_id,
+        """
+        Отправка сообщения одним запросом: членство, сообщение, вложения,
+        счётчик ответов или инбокс собираются в CTE вокруг INSERT сообщения.
+        Ключи генерируются заранее, поэтому CTE не зависят друг от друга.
+
+        :param socket_events: События сокета по созданному сообщению,
+            записываются в socket_outbox в той же транзакции
+        """
+
+        async def message_socket_events(
+            messages: list[Message], transaction: AsyncSession
+        ) -> list[SocketEvent]:
+            return await socket_events(messages[0], transaction)
+
+        created_messages = await self.__create_messages(
+            conversation_id=conversation_id,
+            author_id=author_id,
+            messages=[
+                MessageSendModel.construct(
+                    text=text, documents=files, reply_uuid=reply_uuid
                 )
-                transaction.add(user_conversation)
-                await transaction.flush()
+            ],
+            socket_events=socket_events and message_socket_events,
+        )
+        return created_messages[0]
+
+    @orm_error_handler
+    async def create_many(
+        self,
+        conversation_id: UUID,
+        author_id: UUID,
+        messages: Sequence[MessageSendModel],
+        socket_events: Optional[SocketEventsFactory] = None,
+    ) -> list[Message]:
+        """
+        Пакетная отправка тем же единственным запросом, что и create:
+        многострочные INSERT сообщений и вложений, один счётчик на каждого
+        родителя и одно обновление инбокса на пакет.
+
+        :param socket_events: События сокета по списку созданных сообщений
+        :return: Сообщения в порядке messages
+        """
+        return await self.__create_messages(
+            conversation_id=conversation_id,
+            author_id=author_id,
+            messages=messages,
+            socket_events=socket_events,
+        )
 
-            created_message = Message(
+    async def __create_messages(
+        self,
+        conversation_id: UUID,
+        author_id: UUID,
+        messages: Sequence[MessageSendModel],
+        socket_events: Optional[SocketEventsFactory],
+    ) -> list[Message]:
+        message_rows = []
+        documents: dict[UUID, list[Document]] = {}
+        reply_counts: dict[UUID, int] = {}
+        last_root: Optional[dict] = None
+        roots = 0
+        # created_at/updated_at передаются явно: TZDateTime подставляет
+        # текущее время вместо None, а RETURNING возвращает итоговую строку
+        for element in messages:
+            row = dict(
+                uuid=uuid7(),
                 conversation_id=conversation_id,
                 author_id=author_id,
-                parent_id=reply_uuid,
-                text=text,
+                parent_id=element.reply_uuid,
+                text=element.text,
+                reply_count=0,
+                created_at=None,
+                updated_at=None,
             )
-            transaction.add(created_message)
-            await transaction.flush()
+            message_rows.append(row)
+            documents[row["uuid"]] = [
+                Document(uuid=uuid7(), document_id=document_id)
+                for document_id in element.documents
+            ]
+            if element.reply_uuid:
+                reply_counts[element.reply_uuid] = (
+                    reply_counts.get(element.reply_uuid, 0) + 1
+                )
+            else:
+                last_root = row
+                roots += 1
 
-            if files:
-                files_data = [
-                    dict(
-                        document_id=element,
-                    )
-                    for element in files
-                ]
+        ctes = [self.__join_conversation_stmt(conversation_id, author_id)]
+        if any(documents.values()):
+            ctes.append(
+                self.create_many_files_stmt(
+                    data=[
+                        dict(
+                            uuid=element.uuid,
+                            document_id=element.document_id,
+                        )
+                        for elements in documents.values()
+                        for element in elements
+                    ]
+                ).cte("new_documents")
+            )
+            ctes.append(
+                self.create_many_files_messages_stmt(
+                    data=[
+                        dict(
+                            uuid=uuid7(),
+                            message_id=message_uuid,
+                            document_id=element.uuid,
+                        )
+                        for message_uuid, elements in documents.items()
+                        for element in elements
+                    ]
+                ).cte("new_messages_documents")
+            )
 
-                stmt_files = self.create_many_files_stmt(
-                    data=files_data
-                )
+        for index, (reply_uuid, delta) in enumerate(reply_counts.items()):
+            ctes.append(
+                self.__change_reply_count_stmt(
+                    message_uuid=reply_uuid, delta=delta
+                ).cte(f"reply_count_{index}")
+            )
 
-                curr = await transaction.execute(stmt_files)
-                result = curr.scalars().all()
+        if last_root:
+            ctes.append(
+                self.__touch_inbox_stmt(
+                    conversation_id=conversation_id,
+                    author_id=author_id,
+                    message_uuid=last_root["uuid"],
+                    text=last_root["text"],
+                    unread=roots,
+                ).cte("inbox")
+            )
+            ctes.append(
+                self.__touch_conversation_stmt(
+                    conversation_id=conversation_id
+                ).cte("conversation")
+            )
 
-                files_messages_data = [
-                    dict(
-                        message_id=created_message.uuid,
-                        document_id=element,
-                    )
-                    for element in result
-                ]
+        stmt = (
+            insert(self.model)
+            .values(_literal_rows(self.model, message_rows))
+            .returning(self.model)
+        )
+        for cte in ctes:
+            stmt = stmt.add_cte(cte)
 
-                stmt_files = self.create_many_files_messages_stmt(
-                    data=files_messages_data
+        async with self.base.transaction_v2() as transaction:
+            curr = await transaction.execute(
+                select(self.model).from_statement(stmt)
+            )
+            created = {element.uuid: element for element in curr.scalars()}
+            created_messages = []
+            for message_uuid, message_documents in documents.items():
+                created_message = created[message_uuid]
+                set_committed_value(
+                    created_message, "documents", message_documents
                 )
-                await transaction.execute(stmt_files)
+                created_messages.append(created_message)
 
+            await self.__write_socket_events(
+                transaction, created_messages, socket_events
+            )
             await transaction.commit()
-            return created_message
+            return created_messages
+
+    async def stream_history(
+        self,
+        chat_id: UUID,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> AsyncIterator[Row]:
+        """
+        История чата через серверный курсор: строки приходят пачками по
+        EXPORT_CHUNK_SIZE без ORM-сущностей и авторов, память не растёт
+        с размером чата. Порядок - по индексу
+        ix_messages_conversation_id_created_at.
+        """
+        documents = (
+            select(func.array_agg(Document.document_id))
+            .join(
+                MessageDocument, MessageDocument.document_id == Document.uuid
+            )
+            .where(MessageDocument.message_id == self.model.uuid)
+            .correlate(self.model)
+            .scalar_subquery()
+        )
+        stmt = (
+            select(
+                self.model.uuid,
+                self.model.parent_id,
+                self.model.author_id,
+                self.model.text,
+                self.model.reply_count,
+                self.model.created_at,
+                self.model.updated_at,
+                documents.label("documents"),
+            )
+            .where(self.model.conversation_id == chat_id)
+            .order_by(self.model.created_at, self.model.uuid)
+            .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        # created_at отдаётся клиентам как UTC от хранимого значения
+        # (TZDateTime.process_result_value), фильтр сравнивается так же
+        if date_from:
+            stmt = stmt.where(
+                self.model.created_at >= literal(
+                    self.__naive_utc(date_from), type_=DateTime()
+                )
+            )
+        if date_to:
+            stmt = stmt.where(
+                self.model.created_at < literal(
+                    self.__naive_utc(date_to), type_=DateTime()
+                )
+            )
+
+        async with self.base.transaction_v2() as transaction:
+            result = await transaction.stream(stmt)
+            async for rows in result.partitions(EXPORT_CHUNK_SIZE):
+                for row in rows:
+                    yield row
+
+    @staticmethod
+    def __naive_utc(value: datetime.datetime) -> datetime.datetime:
+        if value.tzinfo is None:
+            return value
+        return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    @orm_error_handler
+    async def get_existing_uuids(
+        self, conversation_id: UUID, message_uuids: Sequence[UUID]
+    ) -> set[UUID]:
+        """
+        Какие из сообщений существуют в чате - проверка reply_uuid пакета
+        """
+        if not message_uuids:
+            return set()
+
+        stmt = select(self.model.uuid).where(
+            self.model.conversation_id == conversation_id,
+            self.model.uuid.in_(set(message_uuids)),
+        )
+        async with self.base.transaction_v2() as transaction:
+            curr = await transaction.execute(stmt)
+            return set(curr.scalars().all())
 
     @orm_error_handler
     async def get_all(
@@ -124,30 +351,9 @@ class MessageRepository:
         limit: int = 20,
         offset: int = 0,
     ) -> List[Message]:
-        message_alias_table = aliased(Message, name="m2")
-
-        is_me_case = self.__is_me_expression(user_id=user_id)
-        count_thread_messages = self.__count_thread_messages__expression(
-            alias_t=message_alias_table
-        ).scalar_subquery()
-
-        stmt = select(self.model)
-        stmt = stmt.filter(self.model.conversation_id == chat_id)
-
-        if message_id:
-            stmt = stmt.filter(self.model.parent_id == message_id)
-        else:
-            stmt = stmt.filter(self.model.parent_id.is_(None))
-
         stmt = (
-            stmt.options(
-                joinedload(self.model.author).with_expression(
-                    User.is_me, is_me_case
-                ).options(joinedload(User.avatar), joinedload(User.role)),
-                with_expression(
-                    self.model.thread_count, count_thread_messages
-                ),
-                subqueryload(self.model.documents),
+            self.__messages_stmt(
+                user_id=user_id, chat_id=chat_id, message_id=message_id
             )
             .limit(limit)
             .offset(offset)
@@ -159,13 +365,46 @@ class MessageRepository:
             return curr.scalars().all()
 
     @orm_error_handler
-    async def get_one(self, message_uuid: UUID, user_id: UUID) -> Message:
-        message_alias_table = aliased(Message, name="m2")
-        is_me_case = self.__is_me_expression(user_id=user_id)
-        count_thread_messages = self.__count_thread_messages__expression(
-            alias_t=message_alias_table
+    async def get_page(
+        self,
+        user_id: UUID,
+        chat_id: UUID,
+        message_id: Optional[UUID] = None,
+        limit: int = 20,
+        before: Optional[UUID] = None,
+        after: Optional[UUID] = None,
+    ) -> List[Message]:
+        """
+        Keyset-выборка по uuid7 (упорядочен по времени создания).
+        Сообщения новее after возвращаются по возрастанию, остальные - по
+        убыванию uuid.
+        """
+        stmt = self.__messages_stmt(
+            user_id=user_id, chat_id=chat_id, message_id=message_id
         )
 
+        if after:
+            stmt = stmt.filter(self.model.uuid > after).order_by(
+                asc(self.model.uuid)
+            )
+        else:
+            if before:
+                stmt = stmt.filter(self.model.uuid < before)
+            stmt = stmt.order_by(desc(self.model.uuid))
+
+        async with self.base.transaction_v2() as transaction:
+            curr = await transaction.execute(stmt.limit(limit))
+            return curr.scalars().all()
+
+    @orm_error_handler
+    async def get_one(
+        self,
+        message_uuid: UUID,
+        user_id: UUID,
+        transaction: Optional[AsyncSession] = None,
+    ) -> Message:
+        is_me_case = self.__is_me_expression(user_id=user_id)
+
         stmt = (
             select(self.model)
             .filter(self.model.uuid == message_uuid)
@@ -173,26 +412,70 @@ class MessageRepository:
                 joinedload(self.model.author).with_expression(
                     User.is_me, is_me_case
                 ).options(joinedload(User.avatar), joinedload(User.role)),
-                with_expression(
-                    self.model.thread_count,
-                    count_thread_messages.scalar_subquery(),
-                ),
                 subqueryload(self.model.documents)
             )
         )
 
+        if transaction is not None:
+            curr = await transaction.execute(stmt)
+            return curr.scalar_one()
+
         async with self.base.transaction_v2() as transaction:
             curr = await transaction.execute(stmt)
             return curr.scalar_one()
 
     @orm_error_handler
-    async def delete(self, chat_id: UUID, message_uuid: UUID) -> UUID:
+    async def delete(
+        self,
+        chat_id: UUID,
+        message_uuid: UUID,
+        socket_events: Optional[SocketEventsFactory] = None,
+    ) -> Row:
+        """
+        :param socket_events: События сокета по строке RETURNING
+        :return: Строка RETURNING с uuid, parent_id и author_id удалённого
+            сообщения
+        """
         async with self.base.transaction_v2() as transaction:
-            return await self.base.delete_one(
-                self.model.conversation_id == chat_id,
-                self.model.uuid == message_uuid,
-                transaction=transaction,
+            stmt = (
+                delete(self.model)
+                .where(
+                    self.model.conversation_id == chat_id,
+                    self.model.uuid == message_uuid,
+                )
+                .returning(
+                    self.model.uuid,
+                    self.model.parent_id,
+                    self.model.author_id,
+                )
             )
+            curr = await transaction.execute(stmt)
+            deleted = curr.one()
+
+            if deleted.parent_id:
+                await transaction.execute(
+                    self.__change_reply_count_stmt(
+                        message_uuid=deleted.parent_id, delta=-1
+                    )
+                )
+            else:
+                await transaction.execute(
+                    self.__unread_on_delete_stmt(
+                        conversation_id=chat_id,
+                        author_id=deleted.author_id,
+                        message_uuid=deleted.uuid,
+                    )
+                )
+                await transaction.execute(
+                    self.__refresh_inbox_stmt(
+                        conversation_id=chat_id,
+                        message_uuid=deleted.uuid,
+                    )
+                )
+            await self.__write_socket_events(
+                transaction, deleted, socket_events
+            )
+            return deleted
 
     @orm_error_handler
     async def update(
@@ -200,24 +483,298 @@ class MessageRepository:
         chat_id: UUID,
         message_uuid: UUID,
         text: str,
+        socket_events: Optional[SocketEventsFactory] = None,
     ) -> Message:
-        async with self.base.transaction_v2() as transaction:
-            return await self.base.update(
+        """
+        UPDATE ... RETURNING в CTE, документы подгружаются тем же запросом
+
+        :param socket_events: События сокета по изменённому сообщению
+        """
+        updated = (
+            update(self.model)
+            .where(
                 self.model.conversation_id == chat_id,
                 self.model.uuid == message_uuid,
-                text=text,
-                transaction=transaction,
             )
+            .values(text=text)
+            .returning(*self.model.__table__.c)
+            .cte("updated")
+        )
+        UpdatedMessage = aliased(self.model, updated)
+        stmt = (
+            select(UpdatedMessage)
+            .outerjoin(UpdatedMessage.documents)
+            .options(contains_eager(UpdatedMessage.documents))
+            .execution_options(populate_existing=True)
+        )
+
+        async with self.base.transaction_v2() as transaction:
+            curr = await transaction.execute(stmt)
+            updated_message = curr.unique().scalar_one()
+            await self.__write_socket_events(
+                transaction, updated_message, socket_events
+            )
+            return updated_message
+
+    def __messages_stmt(
+        self,
+        user_id: UUID,
+        chat_id: UUID,
+        message_id: Optional[UUID] = None,
+    ):
+        is_me_case = self.__is_me_expression(user_id=user_id)
+
+        stmt = select(self.model)
+        stmt = stmt.filter(self.model.conversation_id == chat_id)
+
+        if message_id:
+            stmt = stmt.filter(self.model.parent_id == message_id)
+        else:
+            stmt = stmt.filter(self.model.parent_id.is_(None))
+
+        return stmt.options(
+            joinedload(self.model.author).with_expression(
+                User.is_me, is_me_case
+            ).options(joinedload(User.avatar), joinedload(User.role)),
+            subqueryload(self.model.documents),
+        )
+
+    @orm_error_handler
+    async def repair_reply_counts(self) -> int:
+        """
+        Пересчёт reply_count по фактическому числу ответов.
+        :return: Количество исправленных сообщений
+        """
+        replies = aliased(Message, name="replies")
+        actual_count = (
+            select(func.count(replies.uuid))
+            .where(replies.parent_id == self.model.uuid)
+            .correlate(self.model)
+            .scalar_subquery()
+        )
+        stmt = (
+            update(self.model)
+            .where(self.model.reply_count != actual_count)
+            .values(
+                reply_count=actual_count,
+                updated_at=self.model.updated_at,
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+        async with self.base.transaction_v2() as transaction:
+            curr = await transaction.execute(stmt)
+            return curr.rowcount
+
+    def __change_reply_count_stmt(self, message_uuid: UUID, delta: int):
+        # updated_at передаётся явно, чтобы новый ответ не считался
+        # редактированием родительского сообщения
+        return (
+            update(self.model)
+            .where(self.model.uuid == message_uuid)
+            .values(
+                reply_count=func.greatest(self.model.reply_count + delta, 0),
+                updated_at=self.model.updated_at,
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    def __touch_inbox_stmt(
+        self,
+        conversation_id: UUID,
+        author_id: UUID,
+        message_uuid: UUID,
+        text: str,
+        unread: int = 1,
+    ):
+        # Автор прочитал чат до своего сообщения, остальным +unread
+        # непрочитанных (по числу сообщений верхнего уровня в пакете).
+        # Автор добавляется явно: в одном запросе с вступлением в чат
+        # его строка users_conversations ещё не видна.
+        members = union(
+            select(ConversationUser.user_id).where(
+                ConversationUser.conversation_id == conversation_id
+            ),
+            select(
+                literal(author_id, type_=ConversationUser.user_id.type)
+            ),
+        ).subquery("members")
+        is_author = members.c.user_id == author_id
+        message_id = literal(
+            message_uuid, type_=ConversationInbox.last_message_id.type
+        )
+        members = select(
+            members.c.user_id,
+            literal(
+                conversation_id,
+                type_=ConversationInbox.conversation_id.type,
+            ),
+            message_id,
+            literal(text[:INBOX_PREVIEW_LENGTH]),
+            func.now(),
+            case((is_author, message_id), else_=None),
+            case((is_author, 0), else_=unread),
+        )
+
+        stmt = insert(ConversationInbox).from_select(
+            [
+                ConversationInbox.user_id,
+                ConversationInbox.conversation_id,
+                ConversationInbox.last_message_id,
+                ConversationInbox.last_message_preview,
+                ConversationInbox.last_message_at,
+                ConversationInbox.last_read_message_id,
+                ConversationInbox.unread_count,
+            ],
+            members,
+        )
+        return stmt.on_conflict_do_update(
+            index_elements=[
+                ConversationInbox.user_id,
+                ConversationInbox.conversation_id,
+            ],
+            set_=dict(
+                last_message_id=stmt.excluded.last_message_id,
+                last_message_preview=stmt.excluded.last_message_preview,
+                last_message_at=stmt.excluded.last_message_at,
+                last_read_message_id=func.coalesce(
+                    stmt.excluded.last_read_message_id,
+                    ConversationInbox.last_read_message_id,
+                ),
+                # Без параметров: в CTE SQLAlchemy 1.4 ставит параметры
+                # ON CONFLICT в конец позиционного списка
+                unread_count=case(
+                    (
+                        stmt.excluded.last_read_message_id.is_not(None),
+                        stmt.excluded.unread_count,
+                    ),
+                    else_=ConversationInbox.unread_count
+                    + stmt.excluded.unread_count,
+                ),
+            ),
+        )
+
+    async def __write_socket_events(
+        self,
+        transaction: AsyncSession,
+        result,
+        socket_events: Optional[SocketEventsFactory],
+    ) -> None:
+        if socket_events is None:
+            return
+
+        events: list[SocketEvent] = await socket_events(result, transaction)
+        if not events:
+            return
+
+        await transaction.execute(
+            insert(SocketOutbox).values(
+                [
+                    dict(
+                        event=element.event,
+                        namespace=element.namespace,
+                        room=element.room,
+                        payload=element.data,
+                    )
+                    for element in events
+                ]
+            )
+        )
+
+    def __join_conversation_stmt(
+        self, conversation_id: UUID, author_id: UUID
+    ):
+        return (
+            insert(ConversationUser)
+            .values(
+                _literal_rows(
+                    ConversationUser,
+                    [
+                        dict(
+                            conversation_id=conversation_id,
+                            user_id=author_id,
+                            created_at=None,
+                            updated_at=None,
+                        )
+                    ],
+                )
+            )
+            .on_conflict_do_nothing()
+            .cte("membership")
+        )
+
+    def __touch_conversation_stmt(self, conversation_id: UUID):
+        return (
+            update(Conversation)
+            .where(Conversation.uuid == conversation_id)
+            .values(
+                last_message_at=func.now(),
+                updated_at=Conversation.updated_at,
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    def __unread_on_delete_stmt(
+        self,
+        conversation_id: UUID,
+        author_id: UUID,
+        message_uuid: UUID,
+    ):
+        # uuid7 упорядочен по времени: сообщение непрочитано, если оно новее
+        # последнего прочитанного
+        return (
+            update(ConversationInbox)
+            .where(
+                ConversationInbox.conversation_id == conversation_id,
+                ConversationInbox.user_id != author_id,
+                ConversationInbox.unread_count > 0,
+                or_(
+                    ConversationInbox.last_read_message_id.is_(None),
+                    ConversationInbox.last_read_message_id < message_uuid,
+                ),
+            )
+            .values(unread_count=ConversationInbox.unread_count - 1)
+            .execution_options(synchronize_session=False)
+        )
+
+    def __refresh_inbox_stmt(self, conversation_id: UUID, message_uuid: UUID):
+        latest = (
+            select(self.model)
+            .where(
+                self.model.conversation_id == conversation_id,
+                self.model.parent_id.is_(None),
+            )
+            .order_by(desc(self.model.uuid))
+            .limit(1)
+        )
+        return (
+            update(ConversationInbox)
+            .where(
+                ConversationInbox.conversation_id == conversation_id,
+                ConversationInbox.last_message_id == message_uuid,
+            )
+            .values(
+                last_message_id=latest.with_only_columns(
+                    self.model.uuid
+                ).scalar_subquery(),
+                last_message_preview=latest.with_only_columns(
+                    func.left(self.model.text, INBOX_PREVIEW_LENGTH)
+                ).scalar_subquery(),
+                # created_at хранится по Москве без часового пояса. Если
+                # сообщений не осталось, время активности не меняется
+                last_message_at=func.coalesce(
+                    latest.with_only_columns(
+                        func.timezone(
+                            MOSCOW_TIMEZONE.zone, self.model.created_at
+                        )
+                    ).scalar_subquery(),
+                    ConversationInbox.last_message_at,
+                ),
+            )
+            .execution_options(synchronize_session=False)
+        )
 
     def __is_me_expression(self, user_id: UUID):
         return case(
             [(self.model.author_id == user_id, True)], else_=False
         ).label("is_me")
-
-    def __count_thread_messages__expression(self, alias_t: Type[Message]):
-        return select(func.count()).select_from(
-            select(alias_t)
-            .where(alias_t.parent_id == self.model.uuid)
-            .correlate(self.model)
-            .subquery()
-        )
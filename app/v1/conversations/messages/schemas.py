@@ -1,5 +1,4 @@
-from __future__ import annotations
-
+from datetime import datetime
 from enum import Enum
 from typing import Any
 from typing import Any
@@ -15,6 +14,9 @@ from pydantic import validator
 
 from app.v1.schemas.base import BaseModelORM
 from app.v1.schemas.base import BaseTimeStampMixin
+from app.v1.schemas.pagination import PaginationTypeEnum
+from app.v1.schemas.pagination import decode_cursor
+from app.v1.schemas.responses import DetailError
 from app.v1.users.schemas import GetMeUserModel
 from app.v1.users.schemas import GetUserModel
 from config import settings_app
@@ -63,6 +65,46 @@ class MessageSendModel(BaseModelORM):
     documents: list[UUID] = Field([])
 
 
+class MessageBatchItemSendModel(MessageSendModel):
+    # Длина колонки messages.text: слишком длинный текст отклоняет только
+    # своё сообщение, а не весь пакет
+    text: str = Field(..., max_length=2048)
+
+
+class MessageBatchSendModel(BaseModelORM):
+    """
+    Элементы проверяются по отдельности (MessageBatchItemSendModel),
+    поэтому ошибка в одном сообщении не отклоняет весь пакет
+    """
+
+    messages: list[dict[str, Any]] = Field(
+        ...,
+        min_items=1,
+        max_items=settings_app.MESSAGES_BATCH_MAX_SIZE,
+    )
+
+
+class MessageBatchItemResultModel(BaseModelORM):
+    index: int
+    uuid: Optional[UUID] = None
+    errors: list[DetailError] = Field([])
+
+
+class MessageBatchResultModel(BaseModelORM):
+    created: int
+    items: list[MessageBatchItemResultModel]
+
+
+class MessagesCreatedSocketModel(BaseModelORM):
+    """
+    Одно событие на пакет. Счётчики тредов клиент увеличивает сам
+    по reply_uuid новых сообщений
+    """
+
+    conversation_id: UUID
+    messages: list[MessageGetModel]
+
+
 class MessageSendResultModel(BaseModelORM):
     uuid: UUID
     conversation_id: UUID
@@ -84,6 +126,68 @@ class UpdateMessageModel(BaseModelORM):
     text: str
 
 
+class QueryMessageExportModel(BaseModelORM):
+    date_from: Optional[datetime] = Field(
+        None, description="Сообщения, созданные не раньше этого времени"
+    )
+    date_to: Optional[datetime] = Field(
+        None, description="Сообщения, созданные раньше этого времени"
+    )
+
+    @root_validator(skip_on_failure=True)
+    def validate_range(cls, values: dict[str, Any]) -> dict[str, Any]:
+        date_from, date_to = values.get("date_from"), values.get("date_to")
+        if date_from and date_to and date_from > date_to:
+            raise ValueError("date_from должна быть раньше date_to.")
+        return values
+
+
 class QueryMessageModel(BaseModelORM):
-    limit: int = Field(20)
-    offset: int = Field("0")
+    limit: int = Field(20, ge=1, le=100)
+    offset: int = Field("0", description="Устарело, используйте курсоры")
+    pagination: PaginationTypeEnum = Field(PaginationTypeEnum.OFFSET)
+    before: Optional[str] = Field(
+        None, description="Курсор для загрузки более старых сообщений"
+    )
+    after: Optional[str] = Field(
+        None, description="Курсор для загрузки более новых сообщений"
+    )
+
+    @validator("before", "after")
+    def validate_cursor(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None:
+            cls.decode_message_cursor(value)
+        return value
+
+    @root_validator(skip_on_failure=True)
+    def validate_direction(cls, values: dict[str, Any]) -> dict[str, Any]:
+        if values.get("before") and values.get("after"):
+            raise ValueError("Нельзя одновременно передать before и after.")
+        return values
+
+    @staticmethod
+    def decode_message_cursor(cursor: str) -> UUID:
+        try:
+            return UUID(decode_cursor(cursor)[0])
+        except (AttributeError, TypeError, ValueError) as exc:
+            raise ValueError("Некорректный курсор пагинации") from exc
+
+    @property
+    def is_cursor(self) -> bool:
+        return bool(
+            self.pagination == PaginationTypeEnum.CURSOR
+            or self.before
+            or self.after
+        )
+
+    @property
+    def before_uuid(self) -> Optional[UUID]:
+        if self.before:
+            return self.decode_message_cursor(self.before)
+        return None
+
+    @property
+    def after_uuid(self) -> Optional[UUID]:
+        if self.after:
+            return self.decode_message_cursor(self.after)
+        return None
@@ -1,14 +1,35 @@
 import datetime
+import json
+from typing import AsyncIterator
 from typing import Optional
 from uuid import UUID
 
+from pydantic import BaseModel
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.engine import Row
+
 from app.db.models import Message
-from app.services.redis.queue.client import RedisSocketQueue
+from app.exceptions.db.exceptions import handle_db_api_error
+from app.i18n.tr import translate_pydantic
+from app.socket.outbox import SocketEvent
+from app.socket.outbox import SocketOutboxDispatcher
+from app.socket.rooms import SOCKET_NAMESPACE
+from app.socket.rooms import conversation_room
 from app.v1.conversations.messages.repo import MessageRepository
+from app.v1.conversations.messages.schemas import FileModelDTO
+from app.v1.conversations.messages.schemas import MessageBatchItemResultModel
+from app.v1.conversations.messages.schemas import MessageBatchItemSendModel
+from app.v1.conversations.messages.schemas import MessageBatchResultModel
 from app.v1.conversations.messages.schemas import MessageDeleteSocketModel
 from app.v1.conversations.messages.schemas import MessageGetModel
+from app.v1.conversations.messages.schemas import MessagesCreatedSocketModel
+from app.v1.schemas.pagination import CursorPage
+from app.v1.schemas.pagination import encode_cursor
+from app.v1.schemas.responses import DetailError
 from app.v1.users.schemas import GetCurrentUserModel
 from app.utils.encoders import jsonable_encoder
+from app.v1.users.schemas import GetMeUserModel
 from app.v1.users.schemas import GetUserModel
 
 
@@ -16,10 +37,24 @@ class MessageService:
     def __init__(
         self,
         repo: MessageRepository,
-        redis: RedisSocketQueue,
+        outbox: SocketOutboxDispatcher,
     ):
         self.repo = repo
-        self.redis = redis
+        self.outbox = outbox
+
+    @staticmethod
+    def socket_event(
+        event: str,
+        data: BaseModel,
+        conversation_id: UUID,
+        by_alias: bool = False,
+    ) -> SocketEvent:
+        return SocketEvent(
+            event=event,
+            data=jsonable_encoder(data.dict(by_alias=by_alias)),
+            namespace=SOCKET_NAMESPACE,
+            room=conversation_room(conversation_id),
+        )
 
     async def create(
         self,
@@ -28,38 +63,214 @@ class MessageService:
         text: str,
         files: list[UUID],
         reply_uuid: Optional[UUID] = None,
-    ) -> Message:
-        created_message = await self.repo.create(
+    ) -> MessageGetModel:
+        data_for_socket: Optional[MessageGetModel] = None
+
+        async def socket_events(
+            message: Message, transaction: AsyncSession
+        ) -> list[SocketEvent]:
+            nonlocal data_for_socket
+            events = []
+            if reply_uuid:
+                # Автор и вложения родителя неизвестны - родитель
+                # перечитывается в той же транзакции
+                reply_message = await self.repo.get_one(
+                    message_uuid=reply_uuid,
+                    user_id=author.uuid,
+                    transaction=transaction,
+                )
+                events.append(
+                    self.socket_event(
+                        "updateMessageResponse",
+                        MessageGetModel.from_orm(reply_message),
+                        conversation_id=conversation_id,
+                        by_alias=True,
+                    )
+                )
+            data_for_socket = self.to_message_model(
+                message=message, author=author
+            )
+            events.append(
+                self.socket_event(
+                    "newMessageResponse",
+                    data_for_socket,
+                    conversation_id=conversation_id,
+                    by_alias=True,
+                )
+            )
+            return events
+
+        await self.repo.create(
             conversation_id=conversation_id,
             author_id=author.uuid,
             reply_uuid=reply_uuid,
             text=text,
             files=files,
+            socket_events=socket_events,
         )
-        get_created_message = await self.repo.get_one(
-            message_uuid=created_message.uuid, user_id=author.uuid
+        self.outbox.wake()
+
+        return data_for_socket
+
+    async def create_many(
+        self,
+        conversation_id: UUID,
+        author: GetCurrentUserModel,
+        messages: list[dict],
+        locale: str,
+    ) -> MessageBatchResultModel:
+        """
+        Пакетная отправка: каждый элемент проверяется отдельно, корректные
+        сообщения записываются одной транзакцией, в сокет уходит одно
+        событие newMessagesResponse на весь пакет
+        """
+        results = [
+            MessageBatchItemResultModel(index=index)
+            for index in range(len(messages))
+        ]
+        valid: dict[int, MessageBatchItemSendModel] = {}
+        for index, element in enumerate(messages):
+            try:
+                valid[index] = MessageBatchItemSendModel.parse_obj(element)
+            except ValidationError as exc:
+                results[index].errors = self.__item_errors(
+                    index=index, errors=exc.errors(), locale=locale
+                )
+
+        existing = await self.repo.get_existing_uuids(
+            conversation_id=conversation_id,
+            message_uuids=[
+                element.reply_uuid
+                for element in valid.values()
+                if element.reply_uuid
+            ],
         )
-        if reply_uuid:
-            reply_message = await self.repo.get_one(
-                message_uuid=reply_uuid,
-                user_id=author.uuid,
+        # orm_error_handler возвращает None при ошибке базы: без проверки
+        # ответов пакет не записывается
+        if existing is None:
+            handle_db_api_error()
+        for index, element in list(valid.items()):
+            if element.reply_uuid and element.reply_uuid not in existing:
+                results[index].errors = [
+                    DetailError(
+                        loc=("messages", index, "reply_uuid"),
+                        code=f"messages, {index}, reply_uuid",
+                        msg="Сообщение не найдено в чате",
+                        type="value_error.not_found",
+                    )
+                ]
+                del valid[index]
+
+        if not valid:
+            return MessageBatchResultModel(created=0, items=results)
+
+        async def socket_events(
+            created_messages: list[Message], transaction: AsyncSession
+        ) -> list[SocketEvent]:
+            return [
+                self.socket_event(
+                    "newMessagesResponse",
+                    MessagesCreatedSocketModel(
+                        conversation_id=conversation_id,
+                        messages=[
+                            self.to_message_model(
+                                message=element, author=author
+                            )
+                            for element in created_messages
+                        ],
+                    ),
+                    conversation_id=conversation_id,
+                    by_alias=True,
+                )
+            ]
+
+        created_messages = await self.repo.create_many(
+            conversation_id=conversation_id,
+            author_id=author.uuid,
+            messages=list(valid.values()),
+            socket_events=socket_events,
+        )
+        if created_messages is None:
+            handle_db_api_error()
+        self.outbox.wake()
+
+        for index, created_message in zip(valid, created_messages):
+            results[index].uuid = created_message.uuid
+        return MessageBatchResultModel(
+            created=len(created_messages), items=results
+        )
+
+    @staticmethod
+    def __item_errors(
+        index: int, errors: list[dict], locale: str
+    ) -> list[DetailError]:
+        return [
+            DetailError(
+                loc=("messages", index, *error["loc"]),
+                code=", ".join(
+                    str(element)
+                    for element in ("messages", index, *error["loc"])
+                ),
+                msg=error["msg"],
+                type=error["type"],
             )
-            data_for_socket = MessageGetModel.from_orm(reply_message)
-            await self.redis.emit(
-                "updateMessageResponse",
-                jsonable_encoder(data_for_socket.dict(by_alias=True)),
-                namespace="/v1",
+            for error in translate_pydantic.translate(errors, locale)
+        ]
+
+    async def export(
+        self,
+        chat_id: UUID,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None,
+    ) -> AsyncIterator[bytes]:
+        """
+        NDJSON: одно сообщение (верхнего уровня или ответ) на строку,
+        поля совпадают с MessageGetModel без вложенного автора
+        """
+        async for row in self.repo.stream_history(
+            chat_id=chat_id, date_from=date_from, date_to=date_to
+        ):
+            line = json.dumps(
+                {
+                    "uuid": row.uuid,
+                    "reply_uuid": row.parent_id,
+                    "author_id": row.author_id,
+                    "text": row.text,
+                    "thread_count": row.reply_count,
+                    "documents": row.documents or [],
+                    "created_at": row.created_at,
+                    "updated_at": row.updated_at,
+                },
+                default=jsonable_encoder,
+                ensure_ascii=False,
             )
+            yield f"{line}\n".encode()
 
-        data_for_socket = MessageGetModel.from_orm(get_created_message)
-        await self.redis.emit(
-            "newMessageResponse",
-            jsonable_encoder(data_for_socket.dict(by_alias=True)),
-            namespace="/v1",
+    @staticmethod
+    def to_message_model(
+        message: Message,
+        author: GetCurrentUserModel,
+    ) -> MessageGetModel:
+        """
+        Модель сообщения из строки RETURNING и уже известного автора,
+        без повторного чтения из базы
+        """
+        return MessageGetModel(
+            uuid=message.uuid,
+            author_id=message.author_id,
+            conversation_id=message.conversation_id,
+            parent_id=message.parent_id,
+            text=message.text,
+            thread_count=message.reply_count,
+            created_at=message.created_at,
+            updated_at=message.updated_at,
+            author=GetMeUserModel(**author.dict(exclude={"is_me"})),
+            documents=[
+                FileModelDTO.from_orm(element)
+                for element in message.documents
+            ],
         )
 
-        return get_created_message
-
     async def get_all(
         self,
         user_id: UUID,
@@ -76,56 +287,96 @@ class MessageService:
             offset=offset,
         )
 
+    async def get_page(
+        self,
+        user_id: UUID,
+        chat_id: UUID,
+        message_id: Optional[UUID] = None,
+        limit: int = 20,
+        before: Optional[UUID] = None,
+        after: Optional[UUID] = None,
+    ) -> CursorPage[MessageGetModel]:
+        messages = await self.repo.get_page(
+            user_id=user_id,
+            chat_id=chat_id,
+            message_id=message_id,
+            limit=limit + 1,
+            before=before,
+            after=after,
+        )
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if after:
+            messages.reverse()
+
+        next_cursor, prev_cursor = None, None
+        if messages and (has_more or after):
+            next_cursor = encode_cursor(messages[-1].uuid)
+        if messages and (has_more if after else before):
+            prev_cursor = encode_cursor(messages[0].uuid)
+
+        return CursorPage[MessageGetModel](
+            items=messages,
+            next_cursor=next_cursor,
+            prev_cursor=prev_cursor,
+        )
+
     async def delete(
         self,
         conversation_id: UUID,
         message_id: UUID,
         author: GetCurrentUserModel,
     ) -> UUID:
-        message = await self.repo.get_one(
-            message_uuid=message_id,
-            user_id=author.uuid,
-        )
+        async def socket_events(
+            deleted: Row, transaction: AsyncSession
+        ) -> list[SocketEvent]:
+            data_for_socket = MessageDeleteSocketModel(
+                uuid=deleted.uuid,
+                conversation_id=conversation_id,
+                reply_uuid=deleted.parent_id,
+                author=GetUserModel(
+                    first_name=author.first_name,
+                    last_name=author.last_name,
+                    uuid=author.uuid,
+                    login=author.login,
+                    avatar=author.avatar,
+                    is_online=author.is_online,
+                    last_activity=author.last_activity,
+                    role=author.role,
+                ),
+            )
+            events = [
+                self.socket_event(
+                    "deleteMessageResponse",
+                    data_for_socket,
+                    conversation_id=conversation_id,
+                )
+            ]
 
-        await self.repo.delete(
+            if deleted.parent_id:
+                reply_message = await self.repo.get_one(
+                    message_uuid=deleted.parent_id,
+                    user_id=author.uuid,
+                    transaction=transaction,
+                )
+                events.append(
+                    self.socket_event(
+                        "updateMessageResponse",
+                        MessageGetModel.from_orm(reply_message),
+                        conversation_id=conversation_id,
+                        by_alias=True,
+                    )
+                )
+            return events
+
+        deleted = await self.repo.delete(
             chat_id=conversation_id,
             message_uuid=message_id,
+            socket_events=socket_events,
         )
+        self.outbox.wake()
 
-        data_for_socket = MessageDeleteSocketModel(
-            uuid=message_id,
-            conversation_id=conversation_id,
-            reply_uuid=message.parent_id,
-            author=GetUserModel(
-                first_name=author.first_name,
-                last_name=author.last_name,
-                uuid=author.uuid,
-                login=author.login,
-                avatar=author.avatar,
-                is_online=author.is_online,
-                last_activity=author.last_activity,
-                role=author.role,
-            ),
-        )
-        await self.redis.emit(
-            "deleteMessageResponse",
-            jsonable_encoder(data_for_socket.dict()),
-            namespace="/v1",
-        )
-
-        if message.parent_id:
-            reply_message = await self.repo.get_one(
-                message_uuid=message.parent_id,
-                user_id=author.uuid,
-            )
-            data_for_socket = MessageGetModel.from_orm(reply_message)
-            await self.redis.emit(
-                "updateMessageResponse",
-                jsonable_encoder(data_for_socket.dict(by_alias=True)),
-                namespace="/v1",
-            )
-
-        return message_id
+        return deleted.uuid
 
     async def update(
         self,
@@ -133,22 +384,38 @@ class MessageService:
         message_id: UUID,
         author: GetCurrentUserModel,
         text: str,
-    ) -> Message:
+    ) -> MessageGetModel:
+        data_for_socket: Optional[MessageGetModel] = None
+
+        async def socket_events(
+            message: Message, transaction: AsyncSession
+        ) -> list[SocketEvent]:
+            nonlocal data_for_socket
+            if message.author_id == author.uuid:
+                data_for_socket = self.to_message_model(
+                    message=message, author=author
+                )
+            else:
+                message = await self.repo.get_one(
+                    message_uuid=message_id,
+                    user_id=author.uuid,
+                    transaction=transaction,
+                )
+                data_for_socket = MessageGetModel.from_orm(message)
+            return [
+                self.socket_event(
+                    "updateMessageResponse",
+                    data_for_socket,
+                    conversation_id=conversation_id,
+                )
+            ]
 
         await self.repo.update(
             chat_id=conversation_id,
             message_uuid=message_id,
             text=text,
+            socket_events=socket_events,
         )
-        updated_message = await self.repo.get_one(
-            message_uuid=message_id,
-            user_id=author.uuid,
-        )
-        data_for_socket = MessageGetModel.from_orm(updated_message)
-        await self.redis.emit(
-            "updateMessageResponse",
-            jsonable_encoder(data_for_socket.dict()),
-            namespace="/v1",
-        )
+        self.outbox.wake()
 
-        return updated_message
+        return data_for_socket
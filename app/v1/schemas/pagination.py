@@ -0,0 +1,52 @@
+import base64
+import binascii
+import json
+from enum import Enum
+from typing import Any
+from typing import Generic
+from typing import Optional
+from typing import TypeVar
+
+from pydantic.generics import GenericModel
+
+from app.v1.schemas.base import BaseModelORM
+
+ChildT = TypeVar("ChildT")
+
+
+class PaginationTypeEnum(str, Enum):
+    OFFSET = "offset"
+    CURSOR = "cursor"
+
+
+class CursorPage(GenericModel, BaseModelORM, Generic[ChildT]):
+    items: list[ChildT]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+
+def encode_cursor(*values: Any) -> str:
+    """
+    Упаковка значений ключа сортировки в непрозрачный курсор.
+    :param values: Значения ключа сортировки последней/первой записи
+    :return: Строка курсора, безопасная для передачи в query
+    """
+    raw = json.dumps([str(value) for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list[str]:
+    """
+    Распаковка курсора, созданного encode_cursor.
+    :param cursor: Строка курсора
+    :return: Значения ключа сортировки в виде строк
+    """
+    padding = "=" * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (binascii.Error, ValueError) as exc:
+        raise ValueError("Некорректный курсор пагинации") from exc
+
+    if not isinstance(values, list) or not values:
+        raise ValueError("Некорректный курсор пагинации")
+    return values
@@ -15,7 +15,9 @@ from jose import jwt
 from starlette import status as starlette_status
 
 from app.db.models import User
-from app.v1.security.context import verify_password
+from app.v1.security.context import async_verify_password
+from app.v1.security.token_cache import VerifiedToken
+from app.v1.security.token_cache import VerifiedTokenCache
 from app.v1.statuses.enums import StatusEnum
 from app.v1.users.dependencies import UsersDependencyMarker
 from app.v1.users.schemas import GetCurrentUserModel
@@ -28,6 +30,8 @@ JWTPayloadMapping = MutableMapping[
 
 auth_scheme = HTTPBearer()
 
+verified_tokens = VerifiedTokenCache(max_size=settings_app.JWT_CACHE_SIZE)
+
 
 credentials_exception = HTTPException(
     status_code=starlette_status.HTTP_401_UNAUTHORIZED,
@@ -55,7 +59,7 @@ async def authenticate(
     if not user:
         raise credentials_exception
 
-    if not verify_password(password, user.password):
+    if not await async_verify_password(password, user.password):
         raise credentials_exception
     return user
 
@@ -99,7 +103,20 @@ def remove_token_type_in_token(token: str):
 async def decode_jwt(
     token: HTTPAuthorizationCredentials = Depends(auth_scheme),
 ):
-    reformat_token = remove_token_type_in_token(token.credentials)
+    return verify_token(token=token.credentials)
+
+
+def verify_token(token: str) -> tuple[str, Optional[str]]:
+    """
+    Проверка подписи и срока действия JWT.
+    :param token: Токен, допускается префикс Bearer
+    :return: UUID пользователя и сессии из payload
+    """
+    reformat_token = remove_token_type_in_token(token)
+
+    verified = verified_tokens.get(reformat_token)
+    if verified is not None:
+        return verified.sub, verified.session
 
     try:
         payload = jwt.decode(
@@ -110,6 +127,7 @@ async def decode_jwt(
         )
         sub = payload.get("sub", None)
         session = payload.get("session", None)
+        exp = payload.get("exp", None)
 
     except JWTError:
         raise credentials_exception
@@ -117,9 +135,28 @@ async def decode_jwt(
     if sub is None:
         raise credentials_exception
 
+    # Токены без exp не кэшируются: их нельзя вытеснить по времени
+    if exp is not None:
+        verified_tokens.set(
+            reformat_token,
+            VerifiedToken(sub=sub, session=session, exp=float(exp)),
+        )
+
     return sub, session
 
 
+def revoke_token(token: str) -> None:
+    verified_tokens.revoke_token(remove_token_type_in_token(token))
+
+
+def revoke_session(session: UUID) -> None:
+    verified_tokens.revoke_session(str(session))
+
+
+def revoke_user(user_uuid: UUID) -> None:
+    verified_tokens.revoke_subject(str(user_uuid))
+
+
 class GetCurrentUser:
     def __init__(self, status: Optional[List[StatusEnum]] = None):
         self.status = status or [StatusEnum.ACTIVE]
@@ -130,14 +167,14 @@ class GetCurrentUser:
         token: HTTPAuthorizationCredentials = Depends(dependency=auth_scheme),
     ):
         jwt_user_uuid, jwt_session_id = await decode_jwt(token=token)
-        user_db = await user_service.get_one_from_uuid(jwt_user_uuid)
-        if user_db is None:
+        user = await user_service.get_current_from_uuid(jwt_user_uuid)
+        if user is None:
             raise credentials_exception
 
-        if user_db.status_id not in self.status:
+        if user.status_id not in self.status:
             raise account_disabled
 
-        result = GetCurrentUserModel.from_orm(user_db)
+        result = GetCurrentUserModel(**user.dict(exclude={"status_id"}))
         result.session_id = jwt_session_id
 
         return result
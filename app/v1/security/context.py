@@ -1,8 +1,35 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from typing import TypeVar
+
 from passlib.context import CryptContext
+from prometheus_client import Gauge
+
+from config import settings_app
 
+T = TypeVar("T")
 
 PWD_CONTEXT = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt отпускает GIL, поэтому хэширование выносится в потоки и не
+# блокирует event loop. Семафор ограничивает число задач в пуле, остальные
+# ждут в очереди.
+PASSWORD_EXECUTOR = ThreadPoolExecutor(
+    max_workers=settings_app.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash",
+)
+PASSWORD_SEMAPHORE = asyncio.Semaphore(settings_app.PASSWORD_HASH_WORKERS)
+
+password_hash_queue_depth = Gauge(
+    "password_hash_queue_depth",
+    "Операции bcrypt, ожидающие свободного потока",
+)
+password_hash_in_progress = Gauge(
+    "password_hash_in_progress",
+    "Операции bcrypt, выполняющиеся в пуле",
+)
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return PWD_CONTEXT.verify(secret=plain_password, hash=hashed_password)
@@ -10,3 +37,30 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     return PWD_CONTEXT.hash(secret=password)
+
+
+async def _run_in_password_pool(fn: Callable[..., T], *args) -> T:
+    password_hash_queue_depth.inc()
+    try:
+        await PASSWORD_SEMAPHORE.acquire()
+    finally:
+        password_hash_queue_depth.dec()
+
+    try:
+        with password_hash_in_progress.track_inprogress():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(PASSWORD_EXECUTOR, fn, *args)
+    finally:
+        PASSWORD_SEMAPHORE.release()
+
+
+async def async_verify_password(
+    plain_password: str, hashed_password: str
+) -> bool:
+    return await _run_in_password_pool(
+        verify_password, plain_password, hashed_password
+    )
+
+
+async def async_get_password_hash(password: str) -> str:
+    return await _run_in_password_pool(get_password_hash, password)
@@ -0,0 +1,70 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+from typing import Optional
+
+
+class VerifiedToken(NamedTuple):
+    sub: str
+    session: Optional[str]
+    exp: float
+
+
+class VerifiedTokenCache:
+    """
+    Ограниченный LRU проверенных JWT. Ключ - sha256 токена, сам токен в
+    памяти не хранится. Запись действительна до exp из payload.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._tokens: OrderedDict[str, VerifiedToken] = OrderedDict()
+
+    @staticmethod
+    def digest(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[VerifiedToken]:
+        key = self.digest(token)
+        verified = self._tokens.get(key)
+        if verified is None:
+            return None
+
+        if verified.exp <= time.time():
+            del self._tokens[key]
+            return None
+
+        self._tokens.move_to_end(key)
+        return verified
+
+    def set(self, token: str, verified: VerifiedToken) -> None:
+        if self.max_size <= 0:
+            return
+
+        key = self.digest(token)
+        self._tokens[key] = verified
+        self._tokens.move_to_end(key)
+        while len(self._tokens) > self.max_size:
+            self._tokens.popitem(last=False)
+
+    def revoke_token(self, token: str) -> None:
+        self._tokens.pop(self.digest(token), None)
+
+    def revoke_session(self, session: str) -> None:
+        self._revoke_where(lambda verified: verified.session == session)
+
+    def revoke_subject(self, sub: str) -> None:
+        self._revoke_where(lambda verified: verified.sub == sub)
+
+    def clear(self) -> None:
+        self._tokens.clear()
+
+    def _revoke_where(self, predicate) -> None:
+        for key in [
+            key for key, verified in self._tokens.items() if predicate(verified)
+        ]:
+            del self._tokens[key]
+
+    def __len__(self) -> int:
+        return len(self._tokens)
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from typing import Any
+from typing import Awaitable
+from typing import Optional
+from uuid import UUID
+
+from prometheus_client import Counter
+
+from app.v1.users.schemas import CachedCurrentUserModel
+from config import settings_app
+from misc import cache
+
+logger = logging.getLogger(__name__)
+
+# Недоступный Redis не должен блокировать авторизацию: при ошибке или
+# таймауте запрос идёт в базу
+CACHE_TIMEOUT = 0.5
+
+current_user_cache_requests = Counter(
+    "current_user_cache_requests_total",
+    "Обращения к кэшу авторизованного пользователя",
+    ["result"],
+)
+
+
+def current_user_key(uuid: UUID) -> str:
+    return f"users:current:{uuid}"
+
+
+async def _call_cache(operation: Awaitable[Any]) -> Any:
+    try:
+        return await asyncio.wait_for(operation, timeout=CACHE_TIMEOUT)
+    except Exception as exc:
+        logger.warning(msg="current user cache unavailable", exc_info=exc)
+        return None
+
+
+async def get_current_user(uuid: UUID) -> Optional[CachedCurrentUserModel]:
+    """
+    Получить пользователя из кэша.
+    :param uuid: UUID пользователя
+    :return: Закэшированная модель или None при промахе
+    """
+    if settings_app.CURRENT_USER_CACHE_TTL <= 0:
+        return None
+
+    cached = await _call_cache(cache.get(current_user_key(uuid)))
+    if cached is None:
+        current_user_cache_requests.labels(result="miss").inc()
+        return None
+
+    current_user_cache_requests.labels(result="hit").inc()
+    return CachedCurrentUserModel.parse_raw(cached)
+
+
+async def set_current_user(user: CachedCurrentUserModel) -> None:
+    if settings_app.CURRENT_USER_CACHE_TTL <= 0:
+        return
+    await _call_cache(
+        cache.set(
+            current_user_key(user.uuid),
+            user.json(),
+            expire=settings_app.CURRENT_USER_CACHE_TTL,
+        )
+    )
+
+
+async def invalidate_current_user(uuid: UUID) -> None:
+    """
+    Сбросить кэш пользователя. Вызывается после любого изменения
+    профиля или статуса.
+    """
+    await _call_cache(cache.delete(current_user_key(uuid)))
@@ -61,6 +61,10 @@ class GetCurrentUserModel(GetUserWithPhoneEmail):
     session_id: Optional[UUID] = None
 
 
+class CachedCurrentUserModel(GetCurrentUserModel):
+    status_id: int
+
+
 class GetUserWithStatus(GetMeUserModel, StatusGetMixinV3):
     pass
 
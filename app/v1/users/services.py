@@ -1,8 +1,15 @@
+from typing import Optional
+from uuid import UUID
+
 from sqlalchemy.orm import sessionmaker
 
 from app.db.models import User
-from app.v1.security.context import get_password_hash
+from app.v1.security.context import async_get_password_hash
+from app.v1.users.cache import get_current_user
+from app.v1.users.cache import invalidate_current_user
+from app.v1.users.cache import set_current_user
 from app.v1.users.repo import UserRepository
+from app.v1.users.schemas import CachedCurrentUserModel
 
 
 class UserService(UserRepository):
@@ -18,8 +25,8 @@ class UserService(UserRepository):
         password: str,
         status_id: int,
     ) -> User:
-        hashed_password = get_password_hash(password)
-        return await super().create(
+        hashed_password = await async_get_password_hash(password)
+        created_user = await super().create(
             login=login,
             phone=phone,
             first_name=first_name,
@@ -27,3 +34,29 @@ class UserService(UserRepository):
             password=hashed_password,
             status_id=status_id,
         )
+        await invalidate_current_user(uuid=created_user.uuid)
+        return created_user
+
+    async def activate(self, uuid: UUID) -> User:
+        result = await super().activate(uuid=uuid)
+        await invalidate_current_user(uuid=uuid)
+        return result
+
+    async def get_current_from_uuid(
+        self, uuid: UUID
+    ) -> Optional[CachedCurrentUserModel]:
+        """
+        Read-through кэш пользователя для проверки авторизации
+        :return: None, если пользователь не загружен из базы
+        """
+        cached_user = await get_current_user(uuid=uuid)
+        if cached_user is not None:
+            return cached_user
+
+        user_db = await self.get_one_from_uuid(uuid)
+        if user_db is None:
+            return None
+
+        current_user = CachedCurrentUserModel.from_orm(user_db)
+        await set_current_user(user=current_user)
+        return current_user
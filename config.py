@@ -15,6 +15,30 @@ class Settings(BaseSettings):
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int = Field(
         env="JWT_ACCESS_TOKEN_EXPIRE_MINUTES", default=525600
     )
+    JWT_CACHE_SIZE: int = Field(
+        env="JWT_CACHE_SIZE",
+        default=10000,
+        description="Размер LRU проверенных токенов, 0 - без кэша",
+    )
+
+    CURRENT_USER_CACHE_TTL: int = Field(
+        env="CURRENT_USER_CACHE_TTL",
+        default=60,
+        description="Время жизни кэша авторизованного пользователя, сек, "
+        "0 - без кэша",
+    )
+
+    PASSWORD_HASH_WORKERS: int = Field(
+        env="PASSWORD_HASH_WORKERS",
+        default=4,
+        description="Потоки для bcrypt и предел одновременных операций",
+    )
+
+    MESSAGES_BATCH_MAX_SIZE: int = Field(
+        env="MESSAGES_BATCH_MAX_SIZE",
+        default=100,
+        description="Максимум сообщений в одном пакетном запросе",
+    )
 
     BASE_DOMAIN: str = Field(env="BASE_DOMAIN", default="0.0.0.0")
 
@@ -69,6 +93,66 @@ class SettingsOpenSensus(Settings):
     AUTO_MASK_LOGS: bool = Field(env="AUTO_MASK_LOGS", default=True)
     ENABLE_TELEMETRY: bool = Field(env="ENABLE_TELEMETRY", default=True)
     LOG_DATE_FMT: str = Field(env="LOG_DATE_FMT", default="%Y-%m-%d %H:%M:%S")
+    LOG_FILE: str = Field(
+        env="LOG_FILE", default="", description="Пусто - запись в stdout"
+    )
+    LOG_BUFFER_SIZE: int = Field(
+        env="LOG_BUFFER_SIZE",
+        default=10000,
+        description="Максимум записей журнала, ожидающих вывода",
+    )
+    LOG_BATCH_SIZE: int = Field(env="LOG_BATCH_SIZE", default=500)
+    LOG_FLUSH_INTERVAL: float = Field(
+        env="LOG_FLUSH_INTERVAL",
+        default=0.5,
+        description="Период записи неполной пачки журнала, сек",
+    )
+    LOG_OVERFLOW_POLICY: str = Field(
+        env="LOG_OVERFLOW_POLICY",
+        default="drop_oldest",
+        description="drop_oldest или sample - что делать при полном буфере",
+    )
+    LOG_SAMPLE_RATE: float = Field(
+        env="LOG_SAMPLE_RATE",
+        default=1.0,
+        description="Доля запросов, журналируемых и трассируемых полностью",
+    )
+    LOG_SAMPLE_ROUTES: dict[str, float] = Field(
+        env="LOG_SAMPLE_ROUTES",
+        default={},
+        description='Доля по префиксу пути, JSON: {"/api/v1/chats": 0.1}',
+    )
+    LOG_SLOW_REQUEST_MS: int = Field(
+        env="LOG_SLOW_REQUEST_MS",
+        default=1000,
+        description="Запросы дольше порога сохраняются вне выборки",
+    )
+    LOG_KEEP_STATUS_FROM: int = Field(
+        env="LOG_KEEP_STATUS_FROM",
+        default=500,
+        description="Ответы с кодом от этого значения сохраняются всегда",
+    )
+    TRACE_EXPORT_FILE: str = Field(
+        env="TRACE_EXPORT_FILE", default="", description="Пусто - stdout"
+    )
+    TRACE_EXPORT_BUFFER_SIZE: int = Field(
+        env="TRACE_EXPORT_BUFFER_SIZE",
+        default=10000,
+        description="Максимум спанов, ожидающих экспорта",
+    )
+    TRACE_EXPORT_BATCH_SIZE: int = Field(
+        env="TRACE_EXPORT_BATCH_SIZE", default=100
+    )
+    TRACE_EXPORT_INTERVAL: float = Field(
+        env="TRACE_EXPORT_INTERVAL",
+        default=1.0,
+        description="Период экспорта неполной пачки спанов, сек",
+    )
+    LOG_OVERFLOW_SAMPLE_EVERY: int = Field(
+        env="LOG_OVERFLOW_SAMPLE_EVERY",
+        default=10,
+        description="При sample сохраняется каждая N-я запись сверх буфера",
+    )
 
     @property
     def log_config(self):
@@ -93,8 +177,13 @@ class SettingsOpenSensus(Settings):
                 },
                 "json": {
                     "formatter": "json",
-                    "class": "asynclog.AsyncLogDispatcher",
-                    "func": "app.utils.logging.json_logger.write_log",
+                    "class": "app.utils.logging.handlers.BufferedLogHandler",
+                    "capacity": self.LOG_BUFFER_SIZE,
+                    "batch_size": self.LOG_BATCH_SIZE,
+                    "flush_interval": self.LOG_FLUSH_INTERVAL,
+                    "overflow_policy": self.LOG_OVERFLOW_POLICY,
+                    "sample_every": self.LOG_OVERFLOW_SAMPLE_EVERY,
+                    "filename": self.LOG_FILE or None,
                 },
             },
             "loggers": {
@@ -155,6 +244,30 @@ class RedisSettings(BaseSettings):
     REDIS_DB_QUEUE_CHANNEL: str = Field(
         env="REDIS_DB_QUEUE_CHANNEL", default="socketio_channel_v1"
     )
+    REDIS_QUEUE_MAX_CONNECTIONS: int = Field(
+        env="REDIS_QUEUE_MAX_CONNECTIONS", default=50
+    )
+    REDIS_QUEUE_BATCH_WINDOW: float = Field(
+        env="REDIS_QUEUE_BATCH_WINDOW",
+        default=0.005,
+        description="Окно накопления событий сокета, сек. 0 - без пакетов",
+    )
+    REDIS_QUEUE_BATCH_SIZE: int = Field(
+        env="REDIS_QUEUE_BATCH_SIZE",
+        default=100,
+        description="Максимум событий сокета в одной публикации",
+    )
+    SOCKET_OUTBOX_BATCH_SIZE: int = Field(
+        env="SOCKET_OUTBOX_BATCH_SIZE",
+        default=100,
+        description="Событий outbox, отправляемых за одну транзакцию",
+    )
+    SOCKET_OUTBOX_POLL_INTERVAL: float = Field(
+        env="SOCKET_OUTBOX_POLL_INTERVAL",
+        default=0.5,
+        description="Период опроса outbox, сек. События этого процесса "
+        "отправляются сразу после коммита",
+    )
 
     @classmethod
     def dsn(
@@ -1,8 +1,7 @@
-from socketio import AsyncRedisManager
+import socketio
 import uvicorn
 from fastapi import Depends
 from fastapi import FastAPI
-from opencensus.trace.samplers import AlwaysOnSampler
 from starlette.middleware.cors import CORSMiddleware
 from starlette.middleware.trustedhost import TrustedHostMiddleware
 from starlette_exporter import PrometheusMiddleware
@@ -15,11 +14,18 @@ from app.services.ipwhois.client import IPWhoisClient
 from app.services.ipwhois.dependencies import IPWhoisClientMarker
 from app.services.smsaero.dependencies import SMSAeroDependencyMarker
 from app.services.redis.queue.client import RedisSocketQueue
+from app.services.redis.queue.managers import BatchRedisManager
+from app.socket.manager import close_socket_server
+from app.socket.manager import get_socket_server
+from app.socket.outbox import SocketOutboxDispatcher
 from app.services.redis.queue.dependencies import (
     RedisSocketQueueDependencyMarker,
 )
 from app.utils.logging.middlewares import LoggingMiddleware
 from app.utils.logging.middlewares import OpenCensusFastAPIMiddleware
+from app.utils.logging.sampling import RequestSamplingPolicy
+from app.utils.logging.tracing import BatchSpanExporter
+from app.utils.logging.tracing import StreamSpanSink
 from app.v1.binding import own_router_v1
 from app.v1.conversations.chats.dependencies import ChatDependencyMarker
 from app.v1.conversations.chats.repo import ChatRepository
@@ -77,14 +83,65 @@ def get_application_v1() -> FastAPI:
     )
 
     if settings_app.LOGGING:
-        application.middleware("http")(LoggingMiddleware())
+        # Одна выборка на журнал запросов и трассировку
+        sampling_policy = RequestSamplingPolicy(
+            rate=settings_sensus_app.LOG_SAMPLE_RATE,
+            route_rates=settings_sensus_app.LOG_SAMPLE_ROUTES,
+            slow_request_ms=settings_sensus_app.LOG_SLOW_REQUEST_MS,
+            keep_status_from=settings_sensus_app.LOG_KEEP_STATUS_FROM,
+        )
+        application.add_middleware(LoggingMiddleware, policy=sampling_policy)
         if settings_sensus_app.ENABLE_TELEMETRY:
+            # Спаны экспортируются фоновой задачей (запуск и остановка -
+            # в get_parent_app)
+            span_exporter = BatchSpanExporter(
+                sink=StreamSpanSink(
+                    filename=settings_sensus_app.TRACE_EXPORT_FILE or None
+                ),
+                buffer_size=settings_sensus_app.TRACE_EXPORT_BUFFER_SIZE,
+                batch_size=settings_sensus_app.TRACE_EXPORT_BATCH_SIZE,
+                flush_interval=settings_sensus_app.TRACE_EXPORT_INTERVAL,
+            )
+            application.state.span_exporter = span_exporter
             application.middleware("http")(
                 OpenCensusFastAPIMiddleware(
-                    application, sampler=AlwaysOnSampler()
+                    application,
+                    exporter=span_exporter,
+                    policy=sampling_policy,
                 )
             )
 
+    # Один публикатор на процесс: пул соединений переиспользуется всеми
+    # запросами и закрывается при остановке приложения (get_parent_app)
+    socket_queue = RedisSocketQueue(
+        mgr=BatchRedisManager(
+            url=settings_redis.dsn(
+                host=settings_redis.REDIS_HOST,
+                port=settings_redis.REDIS_PORT,
+                database=settings_redis.REDIS_DB_QUEUE,
+                user=settings_redis.REDIS_USER,
+                password=settings_redis.REDIS_PWD,
+            ),
+            channel=settings_redis.REDIS_DB_QUEUE_CHANNEL,
+            write_only=True,
+            redis_options=dict(
+                max_connections=settings_redis.REDIS_QUEUE_MAX_CONNECTIONS,
+            ),
+            batch_window=settings_redis.REDIS_QUEUE_BATCH_WINDOW,
+            batch_size=settings_redis.REDIS_QUEUE_BATCH_SIZE,
+        )
+    )
+    application.state.socket_queue = socket_queue
+    # События сокета пишутся в socket_outbox вместе с данными и
+    # публикуются в фоне (запуск и остановка - в get_parent_app)
+    socket_outbox = SocketOutboxDispatcher(
+        db_session=async_session,
+        queue=socket_queue,
+        batch_size=settings_redis.SOCKET_OUTBOX_BATCH_SIZE,
+        poll_interval=settings_redis.SOCKET_OUTBOX_POLL_INTERVAL,
+    )
+    application.state.socket_outbox = socket_outbox
+
     application.dependency_overrides.update(
         {
             UsersDependencyMarker: lambda: UserService(
@@ -114,18 +171,7 @@ def get_application_v1() -> FastAPI:
             MessageDependencyMarker: lambda: MessageRepository(
                 db_session=async_session
             ),
-            RedisSocketQueueDependencyMarker: lambda: RedisSocketQueue(
-                mgr=AsyncRedisManager(
-                    url=settings_redis.dsn(
-                        host=settings_redis.REDIS_HOST,
-                        port=settings_redis.REDIS_PORT,
-                        database=settings_redis.REDIS_DB_QUEUE,
-                        user=settings_redis.REDIS_USER,
-                        password=settings_redis.REDIS_PWD,
-                    ),
-                    channel=settings_redis.REDIS_DB_QUEUE_CHANNEL,
-                )
-            ),
+            RedisSocketQueueDependencyMarker: lambda: socket_queue,
         }
     )
     application.dependency_overrides.update(
@@ -134,9 +180,7 @@ def get_application_v1() -> FastAPI:
                 repo=application.dependency_overrides.get(
                     MessageDependencyMarker
                 )(),
-                redis=application.dependency_overrides.get(
-                    RedisSocketQueueDependencyMarker
-                )(),
+                outbox=socket_outbox,
             ),
         }
     )
@@ -161,7 +205,33 @@ def get_parent_app() -> FastAPI:
         openapi_tags=tags_metadata,
     )
 
-    application.mount("/api/v1", get_application_v1())
+    application_v1 = get_application_v1()
+    application.mount("/api/v1", application_v1)
+    # Starlette не передаёт lifespan-события в смонтированные приложения.
+    # Outbox останавливается раньше очереди, чтобы дописать пачку
+    application.add_event_handler(
+        "startup", application_v1.state.socket_outbox.start
+    )
+    application.add_event_handler(
+        "shutdown", application_v1.state.socket_outbox.close
+    )
+    application.add_event_handler(
+        "shutdown", application_v1.state.socket_queue.close
+    )
+    span_exporter = getattr(application_v1.state, "span_exporter", None)
+    if span_exporter is not None:
+        application.add_event_handler("startup", span_exporter.start)
+        application.add_event_handler("shutdown", span_exporter.close)
+
+    socket_server = get_socket_server()
+    application.mount(
+        "/ws", socketio.ASGIApp(socket_server, socketio_path="socket.io")
+    )
+
+    async def shutdown_socket_server():
+        await close_socket_server(socket_server)
+
+    application.add_event_handler("shutdown", shutdown_socket_server)
     application.add_route("/__metrics", handle_metrics)
 
     return application
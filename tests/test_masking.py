@@ -0,0 +1,39 @@
+"""
+Маскирование уязвимых данных в логах.
+"""
+import pytest
+from pydantic import ValidationError
+
+try:
+    from app.utils.logging.helper import SensitiveDataMasker
+except ValidationError as exc:
+    pytest.skip(
+        f"Настройки приложения не заданы: {exc}", allow_module_level=True
+    )
+
+
+@pytest.fixture
+def masker() -> SensitiveDataMasker:
+    return SensitiveDataMasker(key_words=("password", "token", "email"))
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ({"password": "secret"}, {"password": "***"}),
+        ({"Password": None}, {"Password": None}),
+        ({"password": ["secret"]}, {"password": "***"}),
+        ({"token": {"access": "a", "refresh": "r"}}, {"token": "***"}),
+        (
+            {"user": {"email": "a@b.c", "name": "n"}},
+            {"user": {"email": "***", "name": "n"}},
+        ),
+        (
+            [{"items": [{"access_token": "t", "id": 1}]}],
+            [{"items": [{"access_token": "***", "id": 1}]}],
+        ),
+        ("password", "password"),
+    ],
+)
+def test_mask(masker: SensitiveDataMasker, value, expected):
+    assert masker.mask(value) == expected
@@ -0,0 +1,245 @@
+"""
+Планы горячих запросов репозиториев на заполненной локальной Postgres.
+
+Запросы снимаются с движка во время вызова методов репозиториев и
+повторяются под EXPLAIN через синхронный движок: psycopg2 подставляет
+параметры сам, поэтому их типы выводятся как в исходном запросе.
+
+На небольшой тестовой базе планировщик предпочитает полный просмотр даже
+при подходящем индексе, поэтому EXPLAIN выполняется с
+enable_seqscan = off. Тогда вместо Seq Scan может появиться полный обход
+чужого индекса, и такой узел тоже считается ошибкой: условие сканирования
+горячей таблицы должно ограничивать первую колонку индекса. Условие
+только по второй колонке Postgres тоже показывает как Index Cond, но
+читает при этом весь индекс.
+
+Без настроенной и заполненной базы модуль пропускается.
+"""
+import asyncio
+import re
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Iterator
+from typing import Optional
+
+import pytest
+from pydantic import ValidationError
+from sqlalchemy import event
+from sqlalchemy import text
+
+try:
+    from misc import async_session
+    from misc import engine
+    from misc import sync_engine
+except ValidationError as exc:
+    pytest.skip(
+        f"Настройки приложения не заданы: {exc}", allow_module_level=True
+    )
+
+from app.v1.conversations.chats.repo import ChatRepository
+from app.v1.conversations.messages.repo import MessageRepository
+
+HOT_TABLES = (
+    "messages",
+    "users_conversations",
+    "users_inbox",
+    "conversations",
+)
+INDEX_SCANS = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+LEADING_COLUMNS_STMT = text(
+    """
+    select index.relname, source.relname, attribute.attname
+    from pg_index
+    join pg_class index on index.oid = pg_index.indexrelid
+    join pg_class source on source.oid = pg_index.indrelid
+    left join pg_attribute attribute
+      on attribute.attrelid = pg_index.indrelid
+     and attribute.attnum = pg_index.indkey[0]
+    where source.relname = any(:tables)
+    """
+)
+
+SEED_STMT = text(
+    """
+    select uc.user_id, uc.conversation_id, parent.uuid as parent_id
+    from users_conversations uc
+    join messages parent on parent.conversation_id = uc.conversation_id
+    where parent.parent_id is null and parent.reply_count > 0
+    limit 1
+    """
+)
+PRIVATE_SEED_STMT = text(
+    """
+    select own.user_id, companion.user_id as companion_id
+    from conversations c
+    join users_conversations own on own.conversation_id = c.uuid
+    join users_conversations companion
+      on companion.conversation_id = c.uuid
+     and companion.user_id <> own.user_id
+    where c.type_id = 1
+    limit 1
+    """
+)
+
+
+def _hot_calls(
+    messages: MessageRepository,
+    chats: ChatRepository,
+    seed: Any,
+    private_seed: Any,
+) -> dict[str, Callable[[], Awaitable]]:
+    return {
+        "message_page": lambda: messages.get_page(
+            user_id=seed.user_id, chat_id=seed.conversation_id
+        ),
+        "thread_page": lambda: messages.get_page(
+            user_id=seed.user_id,
+            chat_id=seed.conversation_id,
+            message_id=seed.parent_id,
+        ),
+        "chat_list": lambda: chats.get_all_from_user_uuid(
+            uuid=seed.user_id, limit=20
+        ),
+        "private_chat": lambda: chats.get_private_chat_from_users(
+            user_1=private_seed.user_id, user_2=private_seed.companion_id
+        ),
+    }
+
+
+def _explain(statement: str, parameters: Any) -> dict[str, Any]:
+    with sync_engine.begin() as connection:
+        connection.exec_driver_sql("set local enable_seqscan = off")
+        curr = connection.exec_driver_sql(
+            "explain (format json) " + statement, parameters
+        )
+        return curr.scalar()[0]["Plan"]
+
+
+def _nodes(plan: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from _nodes(child)
+
+
+def _leading_columns() -> dict[str, tuple[str, Optional[str]]]:
+    """
+    :return: Индексы горячих таблиц: таблица и первая колонка (None для
+        индекса по выражению)
+    """
+    with sync_engine.connect() as connection:
+        curr = connection.execute(
+            LEADING_COLUMNS_STMT, dict(tables=list(HOT_TABLES))
+        )
+        return {index: (table, column) for index, table, column in curr}
+
+
+def _uses_leading_column(condition: Optional[str], column: str) -> bool:
+    # Postgres выводит индексную колонку в условии слева и без таблицы
+    return condition is not None and bool(
+        re.search(rf"(?<![.\w]){column}\s*(=|<|>|~)", condition)
+    )
+
+
+def _full_scans(
+    plan: dict[str, Any],
+    leading_columns: dict[str, tuple[str, Optional[str]]],
+) -> list[str]:
+    """
+    :return: Узлы, просматривающие горячую таблицу целиком
+    """
+    scans = []
+    for node in _nodes(plan):
+        node_type = node["Node Type"]
+        if node_type == "Seq Scan":
+            if node.get("Relation Name") in HOT_TABLES:
+                scans.append(f"Seq Scan on {node['Relation Name']}")
+            continue
+        if node_type not in INDEX_SCANS:
+            continue
+        index = node.get("Index Name")
+        if index not in leading_columns:
+            continue
+        table, column = leading_columns[index]
+        if column is not None and not _uses_leading_column(
+            node.get("Index Cond"), column
+        ):
+            scans.append(f"{node_type} on {table} using {index}")
+    return scans
+
+
+async def _collect_plans() -> dict[str, list[dict[str, Any]]]:
+    """
+    :return: Планы всех SELECT каждого горячего вызова
+    """
+    try:
+        async with engine.connect() as connection:
+            seed = (await connection.execute(SEED_STMT)).first()
+            private_seed = (
+                await connection.execute(PRIVATE_SEED_STMT)
+            ).first()
+    except OSError as exc:
+        pytest.skip(f"База данных недоступна: {exc}")
+    if seed is None:
+        pytest.skip("База данных не заполнена: нет сообщений с ответами")
+    if private_seed is None:
+        pytest.skip("База данных не заполнена: нет личных чатов")
+
+    captured: list[tuple[str, Any]] = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    messages = MessageRepository(db_session=async_session)
+    chats = ChatRepository(db_session=async_session)
+    calls = _hot_calls(messages, chats, seed, private_seed)
+    plans = {}
+    try:
+        for label, call in calls.items():
+            captured.clear()
+            event.listen(engine.sync_engine, "before_cursor_execute", capture)
+            try:
+                await call()
+            finally:
+                event.remove(
+                    engine.sync_engine, "before_cursor_execute", capture
+                )
+            plans[label] = [
+                _explain(statement, parameters)
+                for statement, parameters in captured
+                if statement.lstrip().lower().startswith("select")
+            ]
+    finally:
+        # get_private_chat_from_users выполняется без transaction_v2 и
+        # не закрывает сессию
+        await messages.base.session.close()
+        await chats.base.session.close()
+        await engine.dispose()
+    return plans
+
+
+@pytest.fixture(scope="module")
+def plans() -> dict[str, list[dict[str, Any]]]:
+    return asyncio.run(_collect_plans())
+
+
+@pytest.fixture(scope="module")
+def leading_columns(
+    plans: dict[str, list[dict[str, Any]]]
+) -> dict[str, tuple[str, Optional[str]]]:
+    return _leading_columns()
+
+
+@pytest.mark.parametrize(
+    "label", ["message_page", "thread_page", "chat_list", "private_chat"]
+)
+def test_hot_query_has_no_full_scan(
+    plans: dict[str, list[dict[str, Any]]],
+    leading_columns: dict[str, tuple[str, Optional[str]]],
+    label: str,
+):
+    assert plans[label], f"{label}: запросы не перехвачены"
+    for plan in plans[label]:
+        scans = _full_scans(plan, leading_columns)
+        assert not scans, f"{label}: {scans}"